@@ -0,0 +1,89 @@
+"""
+dispatch throughput of the asyncio and uvloop event loops, each in a fresh interpreter.
+
+    python benchmarks/event_loop.py [--tasks N] [--policy asyncio|uvloop ...]
+
+the application is built before the loop runs, as ``Mirai.run`` does, it must end up on the loop driving it
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import asyncio, json, sys, time
+from ela import runtime
+from ela.app import Mirai
+from ela.priority import Priority
+
+policy = runtime.install_policy(sys.argv[1] == "uvloop")
+app = Mirai("http://localhost:1/", 1, "")  # built before any loop runs
+tasks = int(sys.argv[2])
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    assert app._loop is loop, "application bound to another loop"
+    done = 0
+
+    async def handler():
+        nonlocal done
+        done += 1
+
+    start = time.perf_counter()
+    for _ in range(tasks):
+        app.timer.executor(handler())
+    while done < tasks:
+        await asyncio.sleep(0)
+    handlers = tasks / (time.perf_counter() - start)
+
+    gate = app.priority_gate
+    start = time.perf_counter()
+    for _ in range(tasks // 4):
+        await gate.acquire(Priority.NORMAL)
+        future = loop.create_future()
+        loop.call_soon(future.set_result, None)
+        await future
+        gate.release()
+    trips = tasks // 4 / (time.perf_counter() - start)
+    print(json.dumps({"loop": type(loop).__module__, "handlers": handlers, "round_trips": trips}))
+
+
+runtime.run(main(), name="bench")
+"""
+
+
+def measure(policy: str, tasks: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE, policy, str(tasks)], env=env, cwd=ROOT, check=True, stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=200000, help="handler tasks scheduled per run")
+    parser.add_argument("--policy", action="append", choices=("asyncio", "uvloop"))
+    args = parser.parse_args()
+
+    policies = args.policy or ["asyncio", "uvloop"]
+    if "uvloop" in policies and args.policy is None:
+        try:
+            import uvloop  # noqa: F401
+        except ImportError:
+            print("uvloop not installed, skipped")
+            policies.remove("uvloop")
+
+    for policy in policies:
+        result = measure(policy, args.tasks)
+        print(f"{policy:8} ({result['loop']:16}) {result['handlers']:12,.0f} handler tasks/s  "
+              f"{result['round_trips']:10,.0f} gated round trips/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
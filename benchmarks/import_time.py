@@ -0,0 +1,61 @@
+"""
+import time of ``ela.app`` in a fresh interpreter, exits with status 1 over budget.
+
+    python benchmarks/import_time.py [--budget MS] [--runs N]
+
+the modules deferred until first use must not be imported either
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported on demand, importing ela.app must not pull them in
+DEFERRED = ("aiohttp", "ela.event.events")
+
+_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import ela.app
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {DEFERRED!r} if m in sys.modules]}}))
+"""
+
+
+def measure() -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE], env=env, cwd=ROOT, check=True, stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(out)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=float, default=250.0, help="median import time allowed, in ms")
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    times = sorted(r["elapsed"] * 1000 for r in results)
+    median = statistics.median(times)
+    print(f"import ela.app: median {median:.1f}ms, min {times[0]:.1f}ms, max {times[-1]:.1f}ms "
+          f"over {args.runs} runs (budget {args.budget:.0f}ms)")
+
+    failed = False
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    if loaded:
+        print(f"FAIL: deferred modules imported eagerly: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget:
+        print(f"FAIL: over budget by {median - args.budget:.1f}ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+validated vs trusted (unchecked) model building on representative server payloads.
+
+    python benchmarks/trusted_parse.py [--repeat N]
+
+both modes must build equal models, the script exits with status 1 otherwise
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ela import event  # noqa: E402
+from ela.component.group import GroupMemberList  # noqa: E402
+from ela.message.type import MessageType  # noqa: E402
+from ela.parser import parse  # noqa: E402
+
+MEMBER = {
+    "id": 123, "memberName": "abc", "specialTitle": "", "permission": "MEMBER",
+    "joinTimestamp": 1, "lastSpeakTimestamp": 2, "muteTimeRemaining": 0,
+    "group": {"id": 456, "name": "grp", "permission": "ADMINISTRATOR"}
+}
+GROUP_MESSAGE = {
+    "type": "GroupMessage",
+    "sender": MEMBER,
+    "messageChain": [
+        {"type": "Source", "id": 1, "time": 2},
+        {"type": "Plain", "text": "hello world"},
+        {"type": "At", "target": 1},
+        {"type": "Image", "imageId": "{abc}.jpg", "url": "http://example.com/a.jpg", "path": None, "base64": None},
+        {"type": "Face", "faceId": 1, "name": "x"}
+    ]
+}
+RECALL_EVENT = {
+    "type": "GroupRecallEvent", "authorId": 1, "messageId": 2, "time": 1600000000,
+    "group": {"id": 456, "name": "grp", "permission": "MEMBER"}, "operator": MEMBER
+}
+MEMBER_LIST = [MEMBER] * 200
+
+
+def cases():
+    recall = event.get_event("GroupRecallEvent")
+    return [
+        ("GroupMessage (5 elements)", 20000, lambda t: MessageType.to_message("GroupMessage", GROUP_MESSAGE, t)),
+        ("GroupRecallEvent", 20000, lambda t: parse(recall, RECALL_EVENT, t)),
+        ("memberList of 200 members", 200, lambda t: parse(GroupMemberList, MEMBER_LIST, t)),
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="best of that many rounds")
+    args = parser.parse_args()
+
+    failed = False
+    for name, number, build in cases():
+        if build(False).dict() != build(True).dict():
+            print(f"FAIL: {name}: trusted and validated models differ")
+            failed = True
+            continue
+        validated = min(timeit.repeat(lambda: build(False), number=number, repeat=args.repeat)) / number
+        trusted = min(timeit.repeat(lambda: build(True), number=number, repeat=args.repeat)) / number
+        print(f"{name:28} validated {validated * 1e6:8.1f}us  trusted {trusted * 1e6:8.1f}us  "
+              f"x{validated / trusted:.1f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
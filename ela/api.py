@@ -1,131 +1,281 @@
 import asyncio
 import logging
 import secrets
-from typing import Union, List, Dict, Callable, BinaryIO
+from typing import Union, List, Dict, Callable, BinaryIO, Optional, TYPE_CHECKING
 
-import aiohttp
-
-from . import method
+from . import method, tracing
+from .cache import ReadCache
 from .component.friend import FriendList, Profile, Friend
 from .component.group import Group, GroupList, GroupMemberList, FileList, File, Member
 from .message.base import MessageModel
 from .message.chain import MessageChain, CacheMessage
 from .method import NewResponse
-from .network import Network
+from .logger import RateLimitFilter
+from .network import Network, FrameWriter
+from .outbound import Coalescer, Key, DEFAULT_MAX_LENGTH, is_plain, plain_text, split_chain
+from .parser import parse
+from .priority import Priority, PriorityGate, COMMAND_PRIORITY
+from .reply import ReplyRouter
+from .runtime import LoopBound
 from .types import T
 from .utils import prepare_chain, assert_success
 
+if TYPE_CHECKING:
+    import aiohttp
+
 logger = logging.getLogger(__name__)
+# per-request logs, tune or silence through logging.getLogger("ela.api.request")
+req_logger = logging.getLogger(f"{__name__}.request")
+req_logger.addFilter(RateLimitFilter(rate=10, per=1.0))
+
+
+def _id(target) -> int:
+    return int(getattr(target, "id", target))
 
 
-class API:
-    def __init__(self, baseurl: str, qq: int, verify_key: str, *, loop=None):
-        if not loop:
-            loop = asyncio.get_event_loop()
-        self._network = Network(baseurl, qq, verify_key, loop=loop)
-        self._loop = loop
+class API(LoopBound):
+    def __init__(
+            self,
+            baseurl: str,
+            qq: int,
+            verify_key: str,
+            *, loop=None,
+            cache_ttl: Dict[str, float] = None,
+            max_inflight: int = 32,
+            trusted: bool = None,
+            coalesce_window: float = 0.3,
+            max_length: int = DEFAULT_MAX_LENGTH,
+            reply_ttl: float = 600.0,
+            max_replies: int = 4096,
+            network: Network = None
+    ):
+        """
+        :param trusted: skip pydantic validation for payloads from the server, None follows parser.set_trusted
+        :param coalesce_window: seconds a coalesced send waits for more text to the same target
+        :param max_length: characters of plain text per message when coalescing or splitting
+        :param reply_ttl: seconds replies to a message sent with ``on_reply`` are routed to the callback
+        :param max_replies: messages with an ``on_reply`` callback kept at most, the oldest are forgotten first
+        :param network: connect through this instead, e.g. a :class:`ela.broker.WorkerNetwork`
+        """
+        super().__init__(loop)
+        self._network = network or Network(baseurl, qq, verify_key, loop=loop)
         self._msg_future: Dict[str, asyncio.Future] = {}
-        self.__ws: List[aiohttp.ClientWebSocketResponse] = []
+        self._read_cache = ReadCache(ttl=cache_ttl, loop=loop)
+        self._gate = PriorityGate(max_inflight, loop=loop)
+        self._trusted = trusted
+        self._coalescer = Coalescer(
+            lambda key, chain, priority: self._send_chain(key, chain, None, priority),
+            coalesce_window, max_length, loop=loop
+        )
+        self._replies = ReplyRouter(reply_ttl, max_replies)
+        self.__ws: List["aiohttp.ClientWebSocketResponse"] = []
+        self.__writer: Optional[FrameWriter] = None
 
     @property
     def session_key(self) -> str:
         return self._network.session_key
 
     @property
-    def ws(self) -> aiohttp.ClientWebSocketResponse:
+    def ws(self) -> "aiohttp.ClientWebSocketResponse":
         if not self.__ws:
             raise RuntimeError("Application not running")
         return self.__ws[0]
 
     @ws.setter
-    def ws(self, conn_list: List[aiohttp.ClientWebSocketResponse]):
+    def ws(self, conn_list: List["aiohttp.ClientWebSocketResponse"]):
+        if self.__writer:
+            self.__writer.close()
         self.__ws = conn_list
+        self.__writer = FrameWriter(conn_list[0], loop=self._bound_loop) if conn_list else None
+
+    @property
+    def frame_writer(self) -> FrameWriter:
+        if not self.__writer:
+            raise RuntimeError("Application not running")
+        return self.__writer
 
     @property
     def network(self) -> Network:
         return self._network
 
-    async def _send_req(self, command: str, content: method.BaseSession, *, subcommmand=None, return_obj=None):
+    @property
+    def read_cache(self) -> ReadCache:
+        return self._read_cache
+
+    @property
+    def priority_gate(self) -> PriorityGate:
+        return self._gate
+
+    @property
+    def coalescer(self) -> Coalescer:
+        return self._coalescer
+
+    @property
+    def replies(self) -> ReplyRouter:
+        return self._replies
+
+    async def _send_req(
+            self,
+            command: str,
+            content: method.BaseSession,
+            *, subcommmand=None,
+            return_obj=None,
+            priority: Priority = None
+    ):
+        if priority is None:
+            priority = COMMAND_PRIORITY.get(command, Priority.NORMAL)
         req_id = secrets.token_hex(8)
-        data = method.Request(
-            syncId=req_id,
-            command=command,
-            subCommand=subcommmand,
-            content=content
-        ).json()
-        future = self._loop.create_future()
-        self._msg_future[str(req_id)] = future
-        logger.debug(data)
-        await self.ws.send_str(data)
-        logger.warning(f"command {command} was called")
+        with tracing.stage("request", tracing.KIND_CLIENT, command=command):
+            with tracing.stage("serialize"):
+                data = method.Request(
+                    syncId=req_id,
+                    command=command,
+                    subCommand=subcommmand,
+                    content=content
+                ).json()
+            with tracing.stage("queue", priority=priority.name):
+                await self._gate.acquire(priority)
+            future = self._loop.create_future()
+            self._msg_future[req_id] = future
+            req_logger.debug("request %s", data)
+            try:
+                self.frame_writer.write(data, future)
+                req_logger.warning("command %s was called", command)
+                with tracing.stage("reply"):
+                    result = await future
+            finally:
+                self._msg_future.pop(req_id, None)
+                self._gate.release()
         return assert_success(
-            await future,
+            result,
             return_obj
         )
 
     async def getMessageFromId(self, message_id: T.Source) -> CacheMessage:
         return CacheMessage(
-            **(await self._send_req("messageFromId", method.GetInfoFromId(
-                id=message_id,
-                sessionKey=self.session_key
-            ), return_obj="data"))
+            **(await self._read_cache.get(
+                ("messageFromId", int(message_id)),
+                lambda: self._send_req("messageFromId", method.GetInfoFromId(
+                    id=message_id,
+                    sessionKey=self.session_key
+                ), return_obj="data")
+            ))
         )
 
-    async def sendGroupMessage(
-            self,
-            group: T.Group,
-            chain: T.Chain,
-            *, quote_msg: T.Source = None
-    ) -> int:
+    async def _send_chain(self, key: Key, chain: T.Chain, quote_msg=None, priority: Priority = None) -> int:
+        kind = key[0]
         if isinstance(chain, list):
-            chain = MessageChain.create(await prepare_chain(self._network, "group", chain), )
-        msg_id = await self._send_req("sendGroupMessage", method.SendMessage(
-            target=group,
-            quote=quote_msg,
-            messageChain=chain,
-            sessionKey=self.session_key
-        ), return_obj="messageId")
+            with tracing.stage("prepare_chain"):
+                chain = MessageChain.create(await prepare_chain(self._network, kind, chain), )
+        if kind == "temp":
+            command, content = "sendTempMessage", method.SendTempMessage(
+                group=key[1],
+                qq=key[2],
+                quote=quote_msg,
+                messageChain=chain,
+                sessionKey=self.session_key
+            )
+        else:
+            command, content = "sendGroupMessage" if kind == "group" else "sendFriendMessage", method.SendMessage(
+                target=key[1],
+                quote=quote_msg,
+                messageChain=chain,
+                sessionKey=self.session_key
+            )
+        msg_id = await self._send_req(command, content, return_obj="messageId", priority=priority)
         if msg_id == -1:
             logger.warning("Message may not be sent")
         return msg_id
 
+    async def _send_message(
+            self,
+            key: Key,
+            chain: T.Chain,
+            quote_msg,
+            priority: Optional[Priority],
+            coalesce: bool,
+            split: bool,
+            on_reply: Optional[Callable] = None
+    ) -> Union[int, List[int]]:
+        msg_id = await self._send_parts(key, chain, quote_msg, priority, coalesce, split)
+        if on_reply is not None:
+            for i in (msg_id if split else (msg_id,)):
+                self._replies.add(key, i, on_reply)
+        return msg_id
+
+    async def _send_parts(
+            self,
+            key: Key,
+            chain: T.Chain,
+            quote_msg,
+            priority: Optional[Priority],
+            coalesce: bool,
+            split: bool
+    ) -> Union[int, List[int]]:
+        outbound = self._coalescer
+        if coalesce and quote_msg is None and is_plain(chain):
+            text = plain_text(chain)
+            if len(text) <= outbound.max_length:
+                msg_id = await outbound.add(key, text, priority)
+                return [msg_id] if split else msg_id
+        if outbound.pending(key):
+            # don't overtake texts still waiting to be merged
+            await outbound.flush(key)
+        if not split:
+            return await self._send_chain(key, chain, quote_msg, priority)
+        ids = []
+        for part in split_chain(chain, outbound.max_length):
+            ids.append(await self._send_chain(key, part, quote_msg, priority))
+            quote_msg = None
+        return ids
+
+    async def sendGroupMessage(
+            self,
+            group: T.Group,
+            chain: T.Chain,
+            *, quote_msg: T.Source = None,
+            priority: Priority = None,
+            coalesce: bool = False,
+            split: bool = False,
+            on_reply: Callable = None
+    ) -> Union[int, List[int]]:
+        """
+        :param coalesce: merge a Plain-only chain with others sent to the same target shortly after,
+        see :class:`ela.outbound.Coalescer`
+        :param split: send an oversized chain as several messages, a list of message ids is returned
+        :param on_reply: called as ``on_reply(app, message)`` with every inbound message quoting the sent one
+        instead of the handler of its type, until ``reply_ttl`` runs out, see :class:`ela.reply.ReplyRouter`
+        """
+        return await self._send_message(("group", _id(group)), chain, quote_msg, priority, coalesce, split, on_reply)
+
     async def sendFriendMessage(
             self,
             friend: T.Friend,
             chain: T.MessageType,
-            *, quote_msg: T.MessageType = None
-    ) -> int:
-        if isinstance(chain, list):
-            chain = MessageChain.create(await prepare_chain(self._network, "friend", chain), )
-        msg_id = await self._send_req("sendFriendMessage", method.SendMessage(
-            target=friend,
-            quote=quote_msg,
-            messageChain=chain,
-            sessionKey=self.session_key
-        ), return_obj="messageId")
-        if msg_id == -1:
-            logger.warning("Message may not be sent")
-        return msg_id
+            *, quote_msg: T.MessageType = None,
+            priority: Priority = None,
+            coalesce: bool = False,
+            split: bool = False,
+            on_reply: Callable = None
+    ) -> Union[int, List[int]]:
+        """see :meth:`sendGroupMessage`"""
+        return await self._send_message(("friend", _id(friend)), chain, quote_msg, priority, coalesce, split, on_reply)
 
     async def sendTempMessage(
             self,
             group: T.Group,
             qq: int,
             chain: T.Chain,
-            *, quote_msg: T.MessageType = None
-    ) -> int:
-        if isinstance(chain, list):
-            chain = MessageChain.create(await prepare_chain(self._network, "temp", chain), )
-        msg_id = await self._send_req("sendTempMessage", method.SendTempMessage(
-            qq=qq,
-            group=group,
-            quote=quote_msg,
-            messageChain=chain,
-            sessionKey=self.session_key
-        ), return_obj="messageId")
-        if msg_id == -1:
-            logger.warning("Message may not be sent")
-        return msg_id
+            *, quote_msg: T.MessageType = None,
+            priority: Priority = None,
+            coalesce: bool = False,
+            split: bool = False,
+            on_reply: Callable = None
+    ) -> Union[int, List[int]]:
+        """see :meth:`sendGroupMessage`"""
+        return await self._send_message(
+            ("temp", _id(group), _id(qq)), chain, quote_msg, priority, coalesce, split, on_reply
+        )
 
     async def recallMessage(self, target: int):
         return await self._send_req("recall", method.GetInfoFromTarget(
@@ -142,52 +292,57 @@ class API:
         ))
 
     async def friendList(self) -> FriendList:
-        return FriendList(
-            __root__=await self._send_req("friendList", method.BaseSession(
-                sessionKey=self.session_key
-            ), return_obj="data")
-        )
+        return parse(FriendList, await self._send_req("friendList", method.BaseSession(
+            sessionKey=self.session_key
+        ), return_obj="data"), self._trusted)
 
     async def groupList(self) -> GroupList:
-        return GroupList(
-            __root__=await self._send_req("groupList", method.BaseSession(
-                sessionKey=self.session_key
-            ), return_obj="data")
-        )
+        return parse(GroupList, await self._send_req("groupList", method.BaseSession(
+            sessionKey=self.session_key
+        ), return_obj="data"), self._trusted)
 
     async def memberList(self, target: Union[int, Group]) -> GroupMemberList:
-        return GroupMemberList(
-            __root__=await self._send_req("memberList", method.GetInfoFromTarget(
-                sessionKey=self.session_key,
-                target=target
-            ), return_obj="data")
-        )
+        return parse(GroupMemberList, await self._send_req("memberList", method.GetInfoFromTarget(
+            sessionKey=self.session_key,
+            target=target
+        ), return_obj="data"), self._trusted)
 
     async def botProfile(self) -> Profile:
         return Profile(
-            **(await self._send_req("botProfile", method.BaseSession(
-                sessionKey=self.session_key
-            )))
+            **(await self._read_cache.get(
+                ("botProfile",),
+                lambda: self._send_req("botProfile", method.BaseSession(
+                    sessionKey=self.session_key
+                ))
+            ))
         )
 
     async def friendProfile(self, target: int) -> Profile:
         return Profile(
-            **(await self._send_req("friendProfile", method.GetInfoFromTarget(
-                sessionKey=self.session_key,
-                target=target
-            )))
+            **(await self._read_cache.get(
+                ("friendProfile", int(target)),
+                lambda: self._send_req("friendProfile", method.GetInfoFromTarget(
+                    sessionKey=self.session_key,
+                    target=target
+                ))
+            ))
         )
 
     async def memberProfile(self, group: T.Group, member: T.Member) -> Profile:
         return Profile(
-            **(await self._send_req("memberProfile", method.GetMemberProfile(
-                sessionKey=self.session_key,
-                target=group,
-                memberId=member
-            )))
+            **(await self._read_cache.get(
+                ("memberProfile", int(group), int(member)),
+                lambda: self._send_req("memberProfile", method.GetMemberProfile(
+                    sessionKey=self.session_key,
+                    target=group,
+                    memberId=member
+                ))
+            ))
         )
 
     async def uploadFile(self, target: T.Group, file: BinaryIO, remote_path: str) -> File:
+        import aiohttp
+
         if remote_path.rfind("/") != -1:
             root, name = remote_path.rsplit("/", 1)
         else:
@@ -201,6 +356,7 @@ class API:
         form.add_field("file", file, filename=name)
 
         res = await self._network.post("/file/upload", data=form)
+        self._read_cache.invalidate("file_list")
         if res["code"] == 0:
             return File(**res["data"])
         else:
@@ -208,37 +364,48 @@ class API:
 
     async def fileList(self, target: [T.Group, T.Friend], parent_id="") -> FileList:
         return FileList(
-            __root__=await self._send_req("file_list", method.GetFile(
-                sessionKey=self.session_key,
-                target=target,
-                id=parent_id
-            ), return_obj="data")
+            __root__=await self._read_cache.get(
+                ("file_list", int(target), parent_id),
+                lambda: self._send_req("file_list", method.GetFile(
+                    sessionKey=self.session_key,
+                    target=target,
+                    id=parent_id
+                ), return_obj="data")
+            )
         )
 
     async def fileInfo(self, target: [T.Group, T.Member], file_id: str) -> File:
         return File(
-            **(await self._send_req("file_info", method.GetFile(
-                sessionKey=self.session_key,
-                target=target,
-                id=file_id
-            )))
+            **(await self._read_cache.get(
+                ("file_info", int(target), file_id),
+                lambda: self._send_req("file_info", method.GetFile(
+                    sessionKey=self.session_key,
+                    target=target,
+                    id=file_id
+                ))
+            ))
         )
 
     async def group_mkdir(self, target: T.Group, name: str, parent_id=""):
-        return await self._send_req("file_mkdir", method.MakeDir(
+        result = await self._send_req("file_mkdir", method.MakeDir(
             sessionKey=self.session_key,
             target=target,
             id=parent_id,
             directoryName=name
         ))
+        self._read_cache.invalidate("file_list")
+        return result
 
     async def group_move_file(self, target: T.Group, target_id: str, dst_id: str):
-        return await self._send_req("file_move", method.MoveFile(
+        result = await self._send_req("file_move", method.MoveFile(
             sessionKey=self.session_key,
             target=target,
             id=target_id,
             moveTo=dst_id
         ))
+        self._read_cache.invalidate("file_list")
+        self._read_cache.invalidate("file_info")
+        return result
 
     async def deleteFriend(self, target: T.Friend):
         return await self._send_req("deleteFriend", method.GetInfoFromTarget(
@@ -319,14 +486,19 @@ class API:
             self,
             target: Union[Group, Friend, Member],
             chain: Union[MessageChain, List[MessageModel], MessageModel],
-            *, quote_msg: T.Source = None
-    ) -> int:
+            *, quote_msg: T.Source = None,
+            priority: Priority = None,
+            coalesce: bool = False,
+            split: bool = False,
+            on_reply: Callable = None
+    ) -> Union[int, List[int]]:
         """"""
         if isinstance(chain, MessageModel):
             chain = [chain]
+        options = dict(quote_msg=quote_msg, priority=priority, coalesce=coalesce, split=split, on_reply=on_reply)
         if isinstance(target, Group):
-            return await self.sendGroupMessage(target, chain, quote_msg=quote_msg)
+            return await self.sendGroupMessage(target, chain, **options)
         elif isinstance(target, (Friend, Member)):
-            return await self.sendFriendMessage(target, chain, quote_msg=quote_msg)
+            return await self.sendFriendMessage(target, chain, **options)
         else:
             raise NotImplementedError(f"unsupport type {type(target)}")
@@ -1,32 +1,124 @@
 import asyncio
+import functools
 import logging
-from typing import Dict, Callable
+from typing import Dict, Callable, List, Awaitable, Iterable, Union, Any, Optional
 
-import aiohttp
-
-from . import event
-from .api import API
+from . import event, tracing
+from .api import API, _id
+from .component.group import Permission
+from .filters import compile_filter, group_id, sender_id
+from .intern import InternPool
+from .keyword import KeywordEngine, KeywordMatch, GLOBAL
 from .message.type import MessageType
+from .parser import parse
+from .reply import inbound_target
+from .runtime import run
 from .timer import Timer
+from .types import T
 from .utils import run_function
+from .waiter import WaiterIndex
+from .watchdog import Watchdog
 
 logger = logging.getLogger(__name__)
 
+# middleware(app, data_type, data, call_next) -> awaitable
+Middleware = Callable[["Mirai", str, dict, Callable[[str, dict], Awaitable]], Awaitable]
+
+_KEYWORD_TYPES = frozenset(("GroupMessage", "FriendMessage", "TempMessage"))
+
+
+def _layer(func: Middleware, app: "Mirai", call_next: Callable[[str, dict], Awaitable]):
+    def layer(data_type: str, data: dict):
+        return func(app, data_type, data, call_next)
+    return layer
+
+
+class ShutdownReport:
+    __slots__ = ["handlers_finished", "handlers_cancelled", "requests_finished", "requests_failed", "elapsed"]
+
+    def __init__(self):
+        self.handlers_finished = 0
+        self.handlers_cancelled = 0  # handlers and jobs still running at the deadline
+        self.requests_finished = 0
+        self.requests_failed = 0  # requests still unanswered at the deadline
+        self.elapsed = 0.0
+
+    @property
+    def lossless(self) -> bool:
+        return not (self.handlers_cancelled or self.requests_failed)
+
+    def __repr__(self):
+        return (
+            f"<ShutdownReport handlers_finished={self.handlers_finished} "
+            f"handlers_cancelled={self.handlers_cancelled} requests_finished={self.requests_finished} "
+            f"requests_failed={self.requests_failed} elapsed={self.elapsed:.3f}>"
+        )
+
 
 class Mirai(API):
-    def __init__(self, baseurl: str, qq: int, verify_key: str, *, loop=None):
-        super().__init__(baseurl, qq, verify_key, loop=loop)
+    def __init__(
+            self,
+            baseurl: str,
+            qq: int,
+            verify_key: str,
+            *, loop=None,
+            lag_threshold: float = None,
+            intern: bool = False,
+            **kwargs
+    ):
+        """
+        :param lag_threshold: report event loop stalls longer than this many seconds while running
+        :param intern: share one Group/Member object per group/member across messages and events,
+        see :mod:`ela.intern`
+        """
+        super().__init__(baseurl, qq, verify_key, loop=loop, **kwargs)
         self._route: Dict[str, Callable] = {}
+        self._filters: Dict[str, Callable[[dict], bool]] = {}
+        self._timeouts: Dict[Union[str, Callable], float] = {}  # by event type, by keyword handler
+        self._middleware: List[Middleware] = []
+        self._accepting = True
 
         self._timer = Timer(loop=loop)
+        self._waiters = WaiterIndex(loop=loop)
+        self._watchdog = Watchdog(threshold=lag_threshold or 0.5, loop=loop)
+        self._monitor_lag = lag_threshold is not None
+        self._pool = InternPool() if intern else None
+        self._keywords: Optional[KeywordEngine] = None
 
     @property
     def timer(self) -> Timer:
         return self._timer
 
-    def register(self, typ: str):
+    @property
+    def watchdog(self) -> Watchdog:
+        return self._watchdog
+
+    @property
+    def intern_pool(self) -> Optional[InternPool]:
+        return self._pool
+
+    @property
+    def keywords(self) -> Optional[KeywordEngine]:
+        return self._keywords
+
+    def register(
+            self,
+            typ: str,
+            *, groups: Iterable[int] = None,
+            senders: Iterable[int] = None,
+            min_permission: Union[Permission, str] = None,
+            timeout: float = None
+    ):
+        """
+        :param groups: only dispatch frames from these groups
+        :param senders: only dispatch frames caused by these users
+        :param min_permission: only dispatch frames whose sender has at least this permission
+        :param timeout: cancel an invocation still running after this many seconds
+        filters are checked against the raw frame, a rejected frame is never parsed
+        """
         if typ in self._route:
             raise AttributeError(f"event {typ} already register")
+        accept = compile_filter(groups, senders, min_permission)
 
         def __(func):
             if not asyncio.iscoroutinefunction(func) and not callable(func):
@@ -34,11 +126,114 @@ class Mirai(API):
                     f"{func.__code__.co_name} is not a callable function"
                 )
             self._route[typ] = func
+            if accept:
+                self._filters[typ] = accept
+            if timeout:
+                self._timeouts[typ] = timeout
+            self._watchdog.watch(func)
+
+        return __
+
+    def keyword(
+            self,
+            words: Iterable[str],
+            *, groups: Iterable[int] = None,
+            ignore_case: bool = False,
+            timeout: float = None
+    ):
+        """
+        call the handler as ``handler(app, message, matches)`` for every message whose Plain text
+        contains any of words, matches being the :class:`ela.keyword.KeywordMatch` found for this handler.
+        all keywords are matched in a single pass, see :mod:`ela.keyword`; the handler runs besides
+        the one registered for the message type, which still receives the message
+        :param groups: only match messages from these groups, friend and temp messages are matched
+        by keywords registered without groups
+        :param ignore_case: applies to all keywords of the application, only taken into account
+        by the first call
+        """
+        if isinstance(words, str):
+            words = [words]
+        if self._keywords is None:
+            self._keywords = KeywordEngine(ignore_case)
+
+        def __(func):
+            if not callable(func):
+                raise ValueError(f"{func} is not a callable function")
+            for group in (groups or (GLOBAL,)):
+                for word in words:
+                    self._keywords.add(word, func, group if group is GLOBAL else int(group))
+            if timeout:
+                self._timeouts[func] = timeout
+            self._watchdog.watch(func)
+            return func
 
         return __
 
-    @staticmethod
-    def _common_handle(inbound_handle, outbound_handle):
+    async def _inbound_keyword(self, data_type: str, data: dict):
+        msg = None
+        if data_type in _KEYWORD_TYPES:
+            found = self._keywords.match_chain(data["messageChain"], group_id(data))
+            if found:
+                per_handler: Dict[Callable, List[KeywordMatch]] = {}
+                for match in found:
+                    for handler in match.payloads:
+                        per_handler.setdefault(handler, []).append(match)
+                msg = self._build(lambda: MessageType.to_message(data_type, data, self._trusted))
+                for handler, matches in per_handler.items():
+                    self._watchdog.track(
+                        tracing.spawn(
+                            "keyword",
+                            lambda: self._timer.executor(run_function(handler, self, msg, matches))
+                        ),
+                        data_type, handler, self._timeouts.get(handler)
+                    )
+        # the message built for keyword handlers is reused by the other ones
+        await self._inbound_message(data_type, data, msg)
+
+    async def wait_for(
+            self,
+            event_type: str,
+            *, group: T.Group = None,
+            sender: Union[T.Member, T.Friend] = None,
+            predicate: Callable[[Any], bool] = None,
+            timeout: float = None
+    ):
+        """
+        wait for the next message or event of event_type, optionally from a given group and/or sender.
+        the first waiter accepting a message consumes it, registered handlers won't receive it
+        :raise asyncio.TimeoutError: nothing matched within timeout seconds
+        """
+        return await self._waiters.add(
+            event_type,
+            _id(group) if group is not None else None,
+            _id(sender) if sender is not None else None,
+            predicate,
+            timeout
+        )
+
+    def middleware(self, func: Middleware) -> Middleware:
+        """
+        register a middleware around inbound dispatch, in registration order (first one is outermost).
+        it is called as ``func(app, data_type, data, call_next)`` with the raw frame, before any model
+        is built; return without awaiting ``call_next(data_type, data)`` to drop the frame.
+        the chain is composed when the application connects, register middlewares before running
+        """
+        if not callable(func):
+            raise ValueError(f"{func} is not a callable function")
+        self._middleware.append(func)
+        return func
+
+    def _compose(self, handle: Callable[[str, dict], Awaitable]) -> Callable[[str, dict], Awaitable]:
+        # fold the chain into nested closures once, dispatch never walks the list
+        for func in reversed(self._middleware):
+            handle = _layer(func, self, handle)
+        return handle
+
+    def _message_handle(self) -> Callable[[str, dict], Awaitable]:
+        # keywords are matched innermost, next to the handlers: only on frames every middleware let through
+        return self._compose(self._inbound_message if self._keywords is None else self._inbound_keyword)
+
+    def _common_handle(self, inbound_handle, outbound_handle):
         async def inner(data: dict):
             if "code" in data:
                 """an error raise"""
@@ -47,37 +242,85 @@ class Mirai(API):
                 # a message receive
                 data, sync_id = data["data"], data["syncId"]
                 if sync_id == "-1":
-                    return await inbound_handle(data["type"], data)
+                    if not self._accepting:
+                        return logger.debug("shutting down, drop %s", data["type"])
+                    with tracing.stage("dispatch"):
+                        return await inbound_handle(data["type"], data)
                 else:
                     return await outbound_handle(data, sync_id)
         return inner
 
-    async def _inbound_message(self, data_type: str, data: dict):
+    def _build(self, model: Callable[[], Any]):
+        with tracing.stage("parse"):
+            obj = model()
+        if self._pool is not None:
+            self._pool.intern(obj)
+        return obj
+
+    async def _inbound_message(self, data_type: str, data: dict, msg=None):
         # qq msg
         if not MessageType.exists(data_type):
             return logger.warning(f'message {data["type"]} not supported, ignore')
-        elif data_type not in self._route:
-            logger.warning(f"cannot handle {data_type} message, ignore")
-        else:
-            msg = MessageType.to_message(data_type, data)
-            self._timer.executor(
-                run_function(self._route[msg.type], self, msg)
+        on_reply = self._replies.route(inbound_target(data_type, data), data["messageChain"])
+        if on_reply is not None:
+            if msg is None:
+                msg = self._build(lambda: MessageType.to_message(data_type, data, self._trusted))
+            self._watchdog.track(
+                tracing.spawn("reply", lambda: self._timer.executor(run_function(on_reply, self, msg))),
+                data_type, on_reply
             )
+            return
+        if data_type in self._waiters:
+            candidates = self._waiters.candidates(data_type, group_id(data), sender_id(data))
+            if candidates:
+                if msg is None:
+                    msg = self._build(lambda: MessageType.to_message(data_type, data, self._trusted))
+                if self._waiters.resolve(candidates, msg):
+                    return
+        handler = self._route.get(data_type)
+        if not handler:
+            return logger.debug("cannot handle %s message, ignore", data_type)
+        accept = self._filters.get(data_type)
+        if accept and not accept(data):
+            return
+        if msg is None:
+            msg = self._build(lambda: MessageType.to_message(data_type, data, self._trusted))
+        self._watchdog.track(
+            tracing.spawn("handler", lambda: self._timer.executor(run_function(handler, self, msg))),
+            data_type, handler, self._timeouts.get(data_type)
+        )
 
     async def _inbound_event(self, data_type: str, data: dict):
         # event
-        if data_type in dir(event):
-            if data_type in self._route:
-                self._timer.executor(
-                    run_function(
-                        self._route[data_type], self,
-                        getattr(event, data_type).parse_obj(data)
-                    )
-                )
-            else:
-                logger.warning(f"cannot handle {data_type} event, ignore")
-        else:
-            logger.warning(f"event {data_type} not found, ignore")
+        event_type = event.get_event(data_type)
+        if not event_type:
+            return logger.warning(f"event {data_type} not found, ignore")
+        ev = None
+        if data_type in self._waiters:
+            candidates = self._waiters.candidates(data_type, group_id(data), sender_id(data))
+            if candidates:
+                ev = self._build(lambda: parse(event_type, data, self._trusted))
+                if self._waiters.resolve(candidates, ev):
+                    return
+        handler = self._route.get(data_type)
+        if not handler:
+            return logger.debug("cannot handle %s event, ignore", data_type)
+        accept = self._filters.get(data_type)
+        if accept and not accept(data):
+            return
+        if ev is None:
+            ev = self._build(lambda: parse(event_type, data, self._trusted))
+        self._watchdog.track(
+            tracing.spawn("handler", lambda: self._timer.executor(run_function(handler, self, ev))),
+            data_type, handler, self._timeouts.get(data_type)
+        )
+
+    async def emit(self, data: dict):
+        """
+        dispatch an event frame generated locally, e.g. a :class:`ela.event.events.FloodEvent`,
+        as if it was received from the server; middlewares are not run
+        """
+        await self._inbound_event(data["type"], data)
 
     async def _outbound_receiver(self, data: dict, sync_id: str):
         # result
@@ -87,13 +330,17 @@ class Mirai(API):
             self._msg_future.pop(sync_id).set_result(data)
 
     async def _connect(self) -> bool:
+        import aiohttp
+
+        self._accepting = True
+        self._timer.resume()
         try:
             self.ws = [
                 await self._network.websocket(
-                    "/message", self._common_handle(self._inbound_message, self._outbound_receiver)
+                    "/message", self._common_handle(self._message_handle(), self._outbound_receiver)
                 ),
                 await self._network.websocket(
-                    "/event", self._common_handle(self._inbound_event, self._outbound_receiver)
+                    "/event", self._common_handle(self._compose(self._inbound_event), self._outbound_receiver)
                 )
             ]
         except aiohttp.ClientConnectorError:
@@ -101,23 +348,57 @@ class Mirai(API):
             return False
         return True
 
+    async def shutdown(self, timeout: float = 10.0) -> ShutdownReport:
+        """
+        stop taking inbound frames and scheduled jobs, then wait up to timeout seconds for running
+        handlers and pending requests before closing; requests still unanswered fail with ConnectionError
+        and handlers still running are cancelled
+        """
+        report = ShutdownReport()
+        start = self._loop.time()
+        deadline = start + timeout
+        self._accepting = False
+        self._timer.stop()
+
+        report.handlers_finished, report.handlers_cancelled = await self._timer.drain(timeout)
+
+        # requests sent outside of handlers, connections stay open so their responses still arrive
+        outstanding = list(self._msg_future.values())
+        remaining = deadline - self._loop.time()
+        if outstanding and remaining > 0:
+            await asyncio.wait(outstanding, timeout=remaining)
+        for future in dict.fromkeys(outstanding + list(self._msg_future.values())):
+            if not future.done():
+                future.set_exception(ConnectionError("application shutting down"))
+                report.requests_failed += 1
+            elif future in outstanding:
+                report.requests_finished += 1
+
+        await self.close()
+        report.elapsed = self._loop.time() - start
+        if report.lossless:
+            logger.info("shutdown completed: %s", report)
+        else:
+            logger.warning("shutdown completed with losses: %s", report)
+        return report
+
     async def close(self):
+        """close the connections right away, running handlers are left alone, see :meth:`shutdown`"""
         await self._network.close()
         await self._network.wait_closed()
+        self.ws = []
 
     async def async_run(self):
+        if self._monitor_lag:
+            self._watchdog.start()
         try:
             if await self._connect():
                 logger.info("Application running")
                 await self._network.wait_closed()
         finally:
+            self._watchdog.stop()
             logger.warning("Application stopped")
 
-    def run(self):
-        try:
-            self._loop.run_until_complete(
-                self._loop.create_task(self.async_run(), name="app")
-            )
-        except KeyboardInterrupt:
-            logger.warning("Interrupt received, stopping...")
-            self._loop.run_until_complete(self.close())
+    def run(self, *, drain_timeout: float = 10.0):
+        """:param drain_timeout: seconds to wait for running handlers when interrupted"""
+        run(self.async_run(), shutdown=functools.partial(self.shutdown, drain_timeout), name="app")
@@ -0,0 +1,379 @@
+"""
+fan one mirai-api-http session out to several worker processes on the same machine.
+
+a :class:`Broker` holds the websockets and publishes inbound frames over a unix domain socket, each worker
+runs a regular :class:`ela.app.Mirai` connected through a :class:`WorkerNetwork`. frames are sharded
+by group (by sender outside of groups), so the frames of a group always reach the same worker, in order.
+commands sent by workers go through the broker's websocket and their responses are routed back by syncId;
+http requests (uploads, files) are made by the workers themselves with the broker's session key.
+
+frames on the socket are a 4-byte big-endian length, a channel byte, then the JSON text
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import stat
+import struct
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import tracing
+from .filters import group_id, sender_id
+from .network import Network, FrameWriter
+from .runtime import LoopBound, run
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_MESSAGE, CHANNEL_EVENT, CHANNEL_CONTROL = 0, 1, 2
+_CHANNELS = {"/message": CHANNEL_MESSAGE, "/event": CHANNEL_EVENT}
+
+_HEADER = struct.Struct("!IB")
+MAX_FRAME = 64 << 20
+
+
+def _pack(channel: int, data: str) -> bytes:
+    payload = data.encode()
+    return _HEADER.pack(len(payload), channel) + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    size, channel = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if size > MAX_FRAME:
+        raise ConnectionError(f"frame of {size} bytes exceeds the limit")
+    return channel, await reader.readexactly(size)
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _remove_socket(path: str):
+    # never delete a regular file or directory found at a mistyped path
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class Broker(LoopBound):
+    def __init__(
+            self,
+            baseurl: str,
+            qq: int,
+            verify_key: str,
+            path: str,
+            workers: int,
+            *, max_buffer=16 << 20,
+            loop=None
+    ):
+        """
+        :param path: unix socket the workers connect to
+        :param workers: number of shards, workers identify themselves by an index in ``range(workers)``
+        :param max_buffer: bytes queued for a worker not keeping up before its frames are dropped
+        """
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+        super().__init__(loop)
+        self.path = path
+        self.workers = workers
+        self.max_buffer = max_buffer
+        self._network = Network(baseurl, qq, verify_key, loop=loop)
+        self._conns: List[Optional[asyncio.StreamWriter]] = [None] * workers
+        self._routes: Dict[str, int] = {}  # syncId of a pending command -> worker
+        self._writer: Optional[FrameWriter] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        self.published = [0] * workers
+        self.dropped = 0
+
+    @property
+    def network(self) -> Network:
+        return self._network
+
+    @property
+    def connected(self) -> List[int]:
+        """indexes of the workers currently connected"""
+        return [index for index, conn in enumerate(self._conns) if conn is not None]
+
+    def shard(self, data: dict) -> Optional[int]:
+        """
+        :return the worker a raw inbound frame goes to. while a worker is away,
+        its shards go to the next connected one
+        """
+        key = group_id(data) or sender_id(data) or 0
+        for i in range(self.workers):
+            index = (key + i) % self.workers
+            if self._conns[index] is not None:
+                return index
+        return None
+
+    def _publish(self, index: Optional[int], channel: int, data: str) -> bool:
+        conn = self._conns[index] if index is not None else None
+        if conn is None or conn.is_closing():
+            self.dropped += 1
+            return False
+        if conn.transport.get_write_buffer_size() > self.max_buffer:
+            self.dropped += 1
+            logger.warning(f"worker {index} is not keeping up, frame dropped")
+            return False
+        conn.write(_pack(channel, data))
+        self.published[index] += 1
+        return True
+
+    def _inbound(self, channel: int):
+        async def inner(pkg: dict):
+            if "code" in pkg:
+                return logger.error(pkg["code"], pkg["msg"])
+            sync_id = pkg.get("syncId")
+            if sync_id == "-1":
+                index = self.shard(pkg["data"])
+            else:
+                index = self._routes.pop(sync_id, None)
+            if not self._publish(index, channel, _dumps(pkg)):
+                logger.debug("no worker for %s, dropped", sync_id)
+        return inner
+
+    def _fail(self, index: int, sync_id: str, error: str):
+        self._routes.pop(sync_id, None)
+        self._publish(index, CHANNEL_MESSAGE, _dumps({"syncId": sync_id, "data": {"code": -1, "msg": error}}))
+
+    def _command(self, index: int, payload: bytes):
+        try:
+            command = json.loads(payload)
+            sync_id = command["syncId"]
+        except (ValueError, TypeError, KeyError):
+            sync_id = None
+        if not isinstance(sync_id, str):
+            # nothing to answer to without a syncId, the connection is kept
+            return logger.warning(f"worker {index}: malformed command dropped")
+        if "command" not in command:
+            return self._fail(index, sync_id, "malformed command")
+        if self._writer is None or self._writer.closed:
+            return self._fail(index, sync_id, "broker not connected")
+        self._routes[sync_id] = index
+        waiter = self._loop.create_future()  # only ever completed by a failed write
+        waiter.add_done_callback(lambda f: self._fail(index, sync_id, str(f.exception())))
+        self._writer.write(payload.decode(), waiter)
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        index = None
+        try:
+            channel, payload = await _read_frame(reader)
+            hello = json.loads(payload) if channel == CHANNEL_CONTROL else {}
+            index = hello.get("worker")
+            if not isinstance(index, int) or not 0 <= index < self.workers:
+                raise ValueError(f"bad handshake {hello}")
+            if self._conns[index] is not None:
+                raise ValueError(f"worker {index} already connected")
+            self._conns[index] = writer
+            writer.write(_pack(CHANNEL_CONTROL, _dumps({
+                "session": self._network.session_key, "qq": self._network.qq
+            })))
+            logger.info(f"worker {index} connected")
+            while True:
+                channel, payload = await _read_frame(reader)
+                if channel == CHANNEL_MESSAGE:
+                    self._command(index, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception(f"worker {index}: connection error")
+        finally:
+            if index is not None and self._conns[index] is writer:
+                self._conns[index] = None
+                for sync_id in [k for k, v in self._routes.items() if v == index]:
+                    del self._routes[sync_id]
+                logger.warning(f"worker {index} disconnected")
+            writer.close()
+
+    async def _wait_session(self, timeout: float):
+        deadline = self._loop.time() + timeout
+        while self._network.session_key is None:
+            if self._network.closed or self._loop.time() > deadline:
+                raise ConnectionError("no session opened")
+            await asyncio.sleep(0.05)
+
+    async def serve(self, timeout: float = 10.0):
+        """connect, then publish frames to workers until the connection closes"""
+        ws = await self._network.websocket("/message", self._inbound(CHANNEL_MESSAGE))
+        await self._network.websocket("/event", self._inbound(CHANNEL_EVENT))
+        self._writer = FrameWriter(ws, loop=self._bound_loop)
+        try:
+            await self._wait_session(timeout)
+            _remove_socket(self.path)  # left by a previous run
+            self._server = await asyncio.start_unix_server(self._serve_worker, self.path)
+            logger.info(f"broker listening on {self.path}")
+            await self._network.wait_closed()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            _remove_socket(self.path)
+        for conn in self._conns:
+            if conn is not None:
+                conn.close()
+        if self._writer is not None:
+            self._writer.close()
+        if not self._network.closed:
+            await self._network.close()
+
+    def run(self):
+        run(self.serve(), shutdown=self.close, name="broker")
+
+
+class _BrokerLink:
+    """stands for the websocket of a worker, frames go to the broker instead"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+
+    async def send_str(self, data: str):
+        if self._writer.is_closing():
+            raise ConnectionError("broker connection closed")
+        self._writer.write(_pack(CHANNEL_MESSAGE, data))
+        await self._writer.drain()
+
+    async def close(self):
+        self._writer.close()
+
+
+class WorkerNetwork(Network):
+    """a :class:`ela.network.Network` receiving its frames from a :class:`Broker`"""
+
+    def __init__(self, url: str, qq: int, path: str, index: int, *, connect_timeout=10.0, loop=None):
+        """
+        :param url: base url of mirai-api-http, for http requests
+        :param index: shard of this worker, in ``range(broker.workers)``
+        :param connect_timeout: seconds to wait for the broker to come up
+        """
+        super().__init__(url, qq, "", loop=loop)
+        self.path = path
+        self.index = index
+        self.connect_timeout = connect_timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._callbacks: Dict[int, Callable] = {}
+
+    async def _open(self):
+        deadline = self._loop.time() + self.connect_timeout
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self._loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        writer.write(_pack(CHANNEL_CONTROL, _dumps({"worker": self.index})))
+        try:
+            channel, payload = await _read_frame(reader)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            raise ConnectionError(f"broker refused worker {self.index}")
+        self._use_session(json.loads(payload)["session"])
+        self._writer = writer
+        self._loop.create_task(self._listen(reader)).add_done_callback(lambda _: self._set_closed())
+        logger.debug(f"worker {self.index}: connected to {self.path}")
+
+    async def _listen(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                channel, payload = await _read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.debug(f"worker {self.index}: broker connection closed")
+                break
+            callback = self._callbacks.get(channel)
+            if callback is None:
+                continue
+            with tracing.trace("inbound", ws=self.index) as root:
+                try:
+                    with tracing.stage("decode"):
+                        pkg = json.loads(payload)
+                    if root is not None:
+                        if pkg.get("syncId") != "-1":
+                            root.discard()  # a response, traced on the request side
+                        else:
+                            root.set("type", pkg["data"].get("type"))
+                    await callback(pkg)
+                except:
+                    logger.exception(f"(worker {self.index}): Callback raise an error")
+
+    async def websocket(self, target: str, callback: Callable, *, name=None) -> _BrokerLink:
+        if target not in _CHANNELS:
+            raise ValueError(f"{target} is not relayed by the broker")
+        if self._writer is None:
+            await self._open()
+        self._callbacks[_CHANNELS[target]] = callback
+        return _BrokerLink(self._writer)
+
+    async def close(self):
+        await super().close()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def reset(self):
+        await super().reset()
+        self._writer = None
+        self._callbacks.clear()
+
+
+def worker(baseurl: str, qq: int, path: str, index: int, **kwargs):
+    """:return a :class:`ela.app.Mirai` served by the broker listening on path"""
+    from .app import Mirai
+
+    network = WorkerNetwork(baseurl, qq, path, index, loop=kwargs.get("loop"))
+    return Mirai(baseurl, qq, "", network=network, **kwargs)
+
+
+def _run_worker(baseurl: str, qq: int, path: str, index: int, setup: Callable, kwargs: dict):
+    app = worker(baseurl, qq, path, index, **kwargs)
+    setup(app)
+    app.run()
+
+
+def run_cluster(
+        baseurl: str,
+        qq: int,
+        verify_key: str,
+        setup: Callable[[Any], Any],
+        workers: int = None,
+        path: str = None,
+        **kwargs
+):
+    """
+    run a broker in this process and one worker per core in child processes
+    :param setup: called with the application of each worker to register its handlers,
+    it must be picklable (a module level function)
+    :param path: unix socket of the broker, by default in a new directory private to this user
+    :param kwargs: passed to the :class:`ela.app.Mirai` of each worker
+    """
+    import multiprocessing
+
+    workers = workers or os.cpu_count() or 1
+    private = None
+    if path is None:
+        # in a directory only this user can enter, a shared /tmp name could be taken over by anyone
+        private = tempfile.mkdtemp(prefix=f"ela-{qq}-", dir=os.environ.get("XDG_RUNTIME_DIR"))
+        path = os.path.join(private, "broker.sock")
+    processes = [
+        multiprocessing.Process(
+            target=_run_worker, args=(baseurl, qq, path, index, setup, kwargs), name=f"ela-worker-{index}"
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        Broker(baseurl, qq, verify_key, path, workers).run()
+    finally:
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        if private is not None:
+            shutil.rmtree(private, ignore_errors=True)
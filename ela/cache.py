@@ -0,0 +1,96 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple, Any, Callable, Awaitable, Optional
+
+from .runtime import LoopBound
+
+# seconds a result stays valid, commands not listed here are only coalesced
+DEFAULT_TTL = {
+    "botProfile": 300.0,
+    "friendProfile": 60.0,
+    "memberProfile": 60.0,
+    "file_list": 5.0,
+    "file_info": 5.0,
+    "messageFromId": 300.0
+}
+
+
+class ReadCache(LoopBound):
+    """
+    a LRU cache for read-only commands, keyed by (command, *args),
+    identical calls in flight share one pending request
+    """
+
+    def __init__(self, maxsize=4096, ttl: Dict[str, float] = None, *, loop=None):
+        super().__init__(loop)
+        self.maxsize = maxsize
+        self._ttl = dict(DEFAULT_TTL)
+        if ttl:
+            self._ttl.update(ttl)
+        self._data: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._pending: Dict[Tuple, asyncio.Task] = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def coalesced(self) -> int:
+        return self._coalesced
+
+    def __len__(self):
+        return len(self._data)
+
+    def set_ttl(self, command: str, ttl: float):
+        """``ttl <= 0`` disables caching for command, concurrent calls are still coalesced"""
+        self._ttl[command] = ttl
+
+    def invalidate(self, command: Optional[str] = None):
+        if command is None:
+            self._data.clear()
+            self._pending.clear()
+            return
+        for key in [k for k in self._data if k[0] == command]:
+            del self._data[key]
+        for key in [k for k in self._pending if k[0] == command]:
+            del self._pending[key]
+
+    async def get(self, key: Tuple, fetch: Callable[[], Awaitable]):
+        item = self._data.get(key)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self._hits += 1
+                self._data.move_to_end(key)
+                return item[1]
+            del self._data[key]
+        task = self._pending.get(key)
+        if task is not None:
+            self._coalesced += 1
+        else:
+            self._misses += 1
+            task = self._loop.create_task(fetch())
+            task.add_done_callback(functools.partial(self._store, key))
+            self._pending[key] = task
+        # a cancelled caller must not cancel the request other callers wait for
+        return await asyncio.shield(task)
+
+    def _store(self, key: Tuple, task: asyncio.Task):
+        if self._pending.get(key) is not task:  # invalidated while in flight
+            return
+        del self._pending[key]
+        ttl = self._ttl.get(key[0], 0)
+        if ttl <= 0 or task.cancelled() or task.exception():
+            return
+        self._data[key] = (time.monotonic() + ttl, task.result())
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
@@ -0,0 +1,322 @@
+"""
+declarative commands parsed from message chain elements.
+
+a spec is the command name followed by its parameters::
+
+    ban <target:at> <minutes:int=10> --silent <reason:text=>
+
+``<name:type>`` is a required positional, ``<name:type=default>`` an optional one (left to its default
+when the next token doesn't convert to its type, the token then goes to the following parameter),
+``--name:type=default`` a keyword given as ``--name value`` (``--name`` alone is a bool flag, ``text`` is
+for positionals only).
+types are ``str`` (default), ``int``, ``float``, ``bool``, ``at`` (an At element, or a qq number),
+``image`` (an Image element) and ``text``, which takes the remaining plain text and must be last.
+specs are compiled once, messages are matched element by element, the chain is never rendered
+"""
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Iterable
+
+from .message.chain import MessageChain, Quote
+from .message.models import Plain, At, Image, Source
+from .utils import run_function
+
+_TOKEN = re.compile(r"\S+")
+_PARAM = re.compile(r"^(?:<(?P<pos>\w+)(?::(?P<ptype>\w+))?(?:=(?P<pdefault>[^>]*))?>"
+                    r"|--(?P<kw>\w+)(?::(?P<ktype>\w+))?(?:=(?P<kdefault>\S*))?)$")
+_TRUE = {"true", "yes", "on", "1"}
+_FALSE = {"false", "no", "off", "0"}
+_REQUIRED = object()
+
+# token kinds
+_TEXT, _AT, _IMAGE, _OTHER = range(4)
+
+
+class CommandError(ValueError):
+    def __init__(self, command: "Command", reason: str):
+        super().__init__(f"{reason}, usage: {command.usage}")
+        self.command = command
+        self.reason = reason
+
+
+def _to_bool(value: str) -> bool:
+    lowered = value.lower()
+    if lowered in _TRUE:
+        return True
+    elif lowered in _FALSE:
+        return False
+    raise ValueError(value)
+
+
+_CONVERTERS: Dict[str, Callable[[str], Any]] = {"str": str, "int": int, "float": float, "bool": _to_bool}
+
+
+class _Param:
+    __slots__ = ["name", "type", "default"]
+
+    def __init__(self, name: str, typ: str, default: Any):
+        if typ not in _CONVERTERS and typ not in ("at", "image", "text"):
+            raise ValueError(f"unknown parameter type '{typ}'")
+        self.name = name
+        self.type = typ
+        self.default = default
+
+    @property
+    def required(self) -> bool:
+        return self.default is _REQUIRED
+
+    def convert(self, command: "Command", kind: int, value: Any) -> Any:
+        typ = self.type
+        if typ == "at":
+            if kind == _AT:
+                return value
+            elif kind == _TEXT and value.lstrip("@").isdigit():
+                return int(value.lstrip("@"))
+        elif typ == "image":
+            if kind == _IMAGE:
+                return value
+        elif kind == _TEXT:
+            try:
+                return _CONVERTERS[typ](value)
+            except ValueError:
+                pass
+        raise CommandError(command, f"'{self.name}' expect {typ}")
+
+    def __str__(self):
+        default = "" if self.required else f"={self.default if self.default is not None else ''}"
+        return f"<{self.name}:{self.type}{default}>"
+
+
+class Command:
+    def __init__(self, spec: str, handler: Callable = None, *, prefix="/", aliases: Iterable[str] = ()):
+        parts = spec.split()
+        if not parts:
+            raise ValueError("empty command spec")
+        self.name = parts[0]
+        self.prefix = prefix
+        self.aliases = tuple(aliases)
+        self.handler = handler
+        self.positional: List[_Param] = []
+        self.keywords: Dict[str, _Param] = {}
+        self._greedy = False
+
+        for part in parts[1:]:
+            m = _PARAM.match(part)
+            if not m:
+                raise ValueError(f"bad parameter '{part}' in command spec '{spec}'")
+            if m["pos"]:
+                if self._greedy:
+                    raise ValueError(f"text parameter must be the last one in '{spec}'")
+                param = self._param(m["pos"], m["ptype"] or "str", m["pdefault"])
+                if param.required and self.positional and not self.positional[-1].required:
+                    raise ValueError(f"required parameter '{param.name}' follows an optional one in '{spec}'")
+                self._greedy = param.type == "text"
+                self.positional.append(param)
+            else:
+                typ = m["ktype"] or "bool"
+                if typ == "text":
+                    raise ValueError(f"keyword '{m['kw']}' can't be of type text in '{spec}'")
+                if m["kdefault"] is None:
+                    # keywords are never required
+                    param = _Param(m["kw"], typ, False if typ == "bool" else None)
+                else:
+                    param = self._param(m["kw"], typ, m["kdefault"])
+                self.keywords[m["kw"]] = param
+
+    @staticmethod
+    def _param(name: str, typ: str, default: Optional[str]) -> _Param:
+        if default is None:
+            return _Param(name, typ, _REQUIRED)
+        if default and typ in _CONVERTERS:
+            default = _CONVERTERS[typ](default)
+        elif not default and typ not in ("str", "text"):
+            default = None
+        return _Param(name, typ, default)
+
+    @property
+    def usage(self) -> str:
+        parts = [self.prefix + self.name, *map(str, self.positional)]
+        for name, param in self.keywords.items():
+            parts.append(f"--{name}" if param.type == "bool" else f"--{name} <{param.type}>")
+        return " ".join(parts)
+
+    def bind(self, tokens: list, segments: List[str]) -> Dict[str, Any]:
+        """:param tokens: tokens after the command name, see :func:`tokenize`"""
+        args = {}
+        positional = iter(self.positional)
+        i = 0
+        while i < len(tokens):
+            kind, value, seg, start = tokens[i]
+            if kind == _TEXT and value.startswith("--") and value[2:] in self.keywords:
+                param = self.keywords[value[2:]]
+                if param.type == "bool":
+                    args[param.name] = True
+                    i += 1
+                    continue
+                if i + 1 >= len(tokens):
+                    raise CommandError(self, f"'{param.name}' expect a value")
+                args[param.name] = param.convert(self, *tokens[i + 1][:2])
+                i += 2
+                continue
+            param = next(positional, None)
+            if param is None:
+                raise CommandError(self, "too many arguments")
+            error = None
+            while param is not None and param.type != "text":
+                try:
+                    args[param.name] = param.convert(self, kind, value)
+                    break
+                except CommandError as e:
+                    if param.required:
+                        raise
+                    # an optional parameter left out, the token goes to the next one
+                    error = error or e
+                    args[param.name] = param.default
+                    param = next(positional, None)
+            else:
+                if param is None:
+                    raise error
+                args[param.name] = _rest(tokens, i, segments)
+                break
+            i += 1
+        for param in positional:
+            if param.required:
+                raise CommandError(self, f"'{param.name}' is required")
+            args[param.name] = param.default
+        for name, param in self.keywords.items():
+            args.setdefault(name, param.default)
+        return args
+
+    def __repr__(self):
+        return f"<Command {self.usage}>"
+
+
+def tokenize(chain: Iterable) -> Tuple[list, List[str]]:
+    """
+    :return (tokens, plain segments), each token is (kind, value, segment index, offset),
+    Source and Quote elements are skipped
+    """
+    tokens = []
+    segments = []
+    for item in chain:
+        if isinstance(item, Plain):
+            seg = len(segments)
+            segments.append(item.text)
+            for m in _TOKEN.finditer(item.text):
+                tokens.append((_TEXT, m.group(), seg, m.start()))
+        elif isinstance(item, At):
+            tokens.append((_AT, item.target, None, None))
+        elif isinstance(item, Image):
+            tokens.append((_IMAGE, item, None, None))
+        elif not isinstance(item, (Source, Quote)):
+            tokens.append((_OTHER, item, None, None))
+    return tokens, segments
+
+
+def _rest(tokens: list, i: int, segments: List[str]) -> str:
+    """plain text from token i to the end, with its original spacing"""
+    parts = []
+    last_seg = None
+    for kind, _, seg, start in tokens[i:]:
+        if kind == _TEXT and seg != last_seg:
+            parts.append(segments[seg][start:])
+            last_seg = seg
+    return "".join(parts).strip()
+
+
+def _cache_key(chain: Iterable) -> Optional[tuple]:
+    key = []
+    for item in chain:
+        if isinstance(item, Plain):
+            key.append(item.text)
+        elif isinstance(item, At):
+            key.append((_AT, item.target))
+        elif isinstance(item, Image) and item.imageId:
+            key.append((_IMAGE, item.imageId))
+        elif not isinstance(item, (Source, Quote)):
+            return None  # not worth caching
+    return tuple(key)
+
+
+class CommandRouter:
+    """
+    finds the command a message invokes by its first token, in one dict lookup however many
+    commands there are; bound arguments are cached by message content, so repeated identical
+    commands skip tokenizing and conversion. cached arguments are copied out, but Image values are shared
+    """
+
+    def __init__(self, prefix="/", cache_size=1024):
+        self.prefix = prefix
+        self.cache_size = cache_size
+        self._commands: Dict[str, Command] = {}
+        self._cache: "OrderedDict[tuple, Tuple[Command, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def commands(self) -> List[Command]:
+        return list(dict.fromkeys(self._commands.values()))
+
+    def add(self, command: Command) -> Command:
+        for name in (command.name, *command.aliases):
+            key = command.prefix + name
+            if key in self._commands:
+                raise AttributeError(f"command {key} already register")
+            self._commands[key] = command
+        self._cache.clear()
+        return command
+
+    def command(self, spec: str, *, aliases: Iterable[str] = ()):
+        """register the decorated function as ``handler(app, message, **args)``"""
+        def __(func):
+            self.add(Command(spec, func, prefix=self.prefix, aliases=aliases))
+            return func
+
+        return __
+
+    def _head(self, chain: MessageChain) -> Optional[Plain]:
+        for item in chain:
+            if isinstance(item, Plain):
+                return item if item.text.lstrip().startswith(self.prefix) else None
+            elif not isinstance(item, (Source, Quote)):
+                return None
+
+    def match(self, chain: MessageChain) -> Optional[Tuple[Command, Dict[str, Any]]]:
+        """
+        :return the command and its bound arguments, None if no command is invoked
+        :raise CommandError: a command is invoked with bad arguments
+        """
+        if self._head(chain) is None:
+            return None
+        key = _cache_key(chain)
+        if key is not None:
+            cached = self._cache.get(key)
+            if cached:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return cached[0], dict(cached[1])
+        self.misses += 1
+        tokens, segments = tokenize(chain)
+        command = self._commands.get(tokens[0][1]) if tokens and tokens[0][0] == _TEXT else None
+        if not command:
+            return None
+        args = command.bind(tokens[1:], segments)
+        if key is not None:
+            self._cache[key] = (command, args)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            args = dict(args)
+        return command, args
+
+    async def dispatch(self, app, message) -> bool:
+        """
+        run the handler of the command invoked by message
+        :return False if message doesn't invoke a command
+        :raise CommandError: a command is invoked with bad arguments
+        """
+        found = self.match(message.messageChain)
+        if not found:
+            return False
+        command, args = found
+        await run_function(command.handler, app, message, **args)
+        return True
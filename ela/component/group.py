@@ -1,12 +1,19 @@
+import asyncio
 import datetime
 import hashlib
+import json
+import logging
 import os
 from enum import Enum
 from typing import List, Optional, Iterable
 
-import aiohttp
 from pydantic import BaseModel, HttpUrl
 
+from ..fileio import AsyncFileWriter, sha1_file
+from ..runtime import get_loop
+
+logger = logging.getLogger(__name__)
+
 
 class Permission(str, Enum):
     Member = "MEMBER"
@@ -114,23 +121,169 @@ class File(BaseModel):
     isDirectory: bool
     downloadInfo: Optional[DownloadInfo]
 
-    async def download_file(self, save_path: str, verify_file=False):
+    async def download_file(self, save_path: str, verify_file=False, *, segments=1, buffer_size=1 << 20):
+        """
+        download into a partial file next to save_path (one per file id), which is renamed to save_path
+        once complete. an existing partial file is resumed with HTTP Range requests if it was started
+        for the same version of the file; a resumed download is always checked against the sha1
+        and started over on mismatch. disk writes and the sha1 check run in the default executor
+        :param segments: fetch that many byte ranges concurrently if the server supports ranges
+        """
         if not self.downloadInfo:
             raise AttributeError("downloadInfo not found")
-        vf = hashlib.sha1() if verify_file else None
+        import aiohttp
+
+        loop = get_loop()
+        # two files of a folder may share a name, never the same partial file
+        part = f"{save_path}.{hashlib.sha1(self.id.encode()).hexdigest()[:12]}.part"
+        url = str(self.downloadInfo.url)
+        expected = self.downloadInfo.sha1.lower()
+        identity = {"sha1": expected, "lastModifyTime": self.downloadInfo.lastModifyTime.isoformat()}
+        async with aiohttp.ClientSession() as session:
+            for attempt in range(2):
+                size = await _remote_size(session, url) if segments > 1 else None
+                if size:
+                    resumed = await _fetch_segments(session, url, part, identity, size, segments, buffer_size)
+                else:
+                    resumed = await _fetch_stream(session, url, part, identity, buffer_size)
+                if not (verify_file or resumed):
+                    break
+                digest = await loop.run_in_executor(None, sha1_file, part)
+                if digest == expected:
+                    break
+                await loop.run_in_executor(None, _discard, part)
+                if not resumed or attempt:
+                    raise ValueError(f"sha1 of {self.name} doesn't match: {digest}, expected {expected}")
+                logger.warning(f"resumed download of {self.name} doesn't match its sha1, starting over")
+        await loop.run_in_executor(None, os.replace, part, save_path)
+
+
+def _discard(part: str, state_only=False):
+    for path in (part + ".json",) if state_only else (part, part + ".json"):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def _allocate(part: str, size: int):
+    with open(part, "wb") as fd:
+        fd.truncate(size)
+
+
+def _load_state(part: str, identity: dict) -> Optional[dict]:
+    """:return what is known of the partial file, None when it belongs to another version of the file"""
+    try:
+        with open(part + ".json", "r") as fd:
+            state = json.load(fd)
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get("identity") != identity or not os.path.isfile(part):
+        return None
+    return state
+
+
+def _save_state(part: str, state: dict):
+    with open(part + ".json", "w") as fd:
+        json.dump(state, fd)
+
+
+def _content_size(resp) -> Optional[int]:
+    # Content-Range: bytes 0-0/1234 or bytes */1234
+    total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+async def _remote_size(session, url: str) -> Optional[int]:
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as resp:
+        return _content_size(resp) if resp.status == 206 else None
+
+
+async def _fetch_stream(session, url: str, part: str, identity: dict, buffer_size: int) -> bool:
+    """:return whether an existing partial file was resumed"""
+    loop = get_loop()
+    state = await loop.run_in_executor(None, _load_state, part, identity)
+    offset = await loop.run_in_executor(None, os.path.getsize, part) if state is not None else 0
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if state.get("validator"):
+            # the server answers 200 with the whole file if it changed since
+            headers["If-Range"] = state["validator"]
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 416:
+            if not offset:
+                raise ConnectionError(resp.status, await resp.text())
+            if _content_size(resp) == offset:
+                return True  # already complete
+            # the partial file is larger than the remote one, it can't be resumed
+            await loop.run_in_executor(None, _discard, part)
+            return await _fetch_stream(session, url, part, identity, buffer_size)
+        elif resp.status == 200:
+            offset = 0  # range not supported or the file changed, start over
+        elif resp.status != 206:
+            raise ConnectionError(resp.status, await resp.text())
+        validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+        await loop.run_in_executor(None, _save_state, part, {"identity": identity, "validator": validator})
+        fd = await loop.run_in_executor(None, open, part, "r+b" if offset else "wb")
+        try:
+            writer = AsyncFileWriter(fd, offset, buffer_size, loop=loop)
+            try:
+                async for chunk in resp.content.iter_chunked(1 << 16):
+                    await writer.write(chunk)
+            finally:
+                await writer.close()
+        finally:
+            await loop.run_in_executor(None, fd.close)
+    await loop.run_in_executor(None, os.remove, part + ".json")
+    return bool(offset)
+
+
+async def _fetch_segments(
+        session, url: str, part: str, identity: dict, size: int, segments: int, buffer_size: int
+) -> bool:
+    """:return whether an existing partial file was resumed"""
+    loop = get_loop()
+    step = -(-size // segments)
+    bounds = [(start, min(start + step, size)) for start in range(0, size, step)]
+    fresh = [start for start, _ in bounds]
+    done = fresh
+    # the state file records how far each segment got, so an interrupted download resumes
+    state = await loop.run_in_executor(None, _load_state, part, identity)
+    if state is not None and state.get("size") == size and len(state.get("done", ())) == len(bounds):
+        done = state["done"]
+    resumed = done != fresh
+    if not resumed:
+        await loop.run_in_executor(None, _allocate, part, size)
+
+    async def fetch(index: int):
+        start, end = done[index], bounds[index][1]
+        if start >= end:
+            return
+        fd = await loop.run_in_executor(None, open, part, "r+b")
+        writer = AsyncFileWriter(fd, start, buffer_size, loop=loop)
         try:
-            with open(save_path, "wb") as fd:
-                async with aiohttp.request("GET", self.downloadInfo.url) as resp:
-                    async for bl in resp.content:
-                        if vf:
-                            vf.update(bl)
-                        fd.write(bl)
-        except:
-            os.remove(save_path)
-            raise
-        if verify_file and vf.hexdigest() != self.downloadInfo.sha1.lower():
-            os.remove(save_path)
-            raise NotImplementedError(vf.hexdigest(), self.downloadInfo.sha1.lower(), "not match")
+            async with session.get(url, headers={"Range": f"bytes={start}-{end - 1}"}) as resp:
+                if resp.status != 206:
+                    raise ConnectionError(resp.status, await resp.text())
+                async for chunk in resp.content.iter_chunked(1 << 16):
+                    await writer.write(chunk)
+        finally:
+            try:
+                await writer.close()
+            finally:
+                done[index] = writer.committed
+                await loop.run_in_executor(None, fd.close)
+
+    tasks = [loop.create_task(fetch(i)) for i in range(len(bounds))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        await loop.run_in_executor(None, _save_state, part, {"identity": identity, "size": size, "done": done})
+        raise
+    await loop.run_in_executor(None, _discard, part, True)
+    return resumed
 
 
 class FileList(BaseModel):
@@ -0,0 +1,227 @@
+"""
+on-disk cache of downloaded resources, e.g. inbound images: a file per resource named after the sha1
+of its key (the imageId, or the url), bounded in total size by evicting the least recently used files
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import mmap
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from .fileio import AsyncFileWriter
+from .runtime import LoopBound
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = memoryview(b"")
+_DIGEST = re.compile(r"[0-9a-f]{40}")  # names of cached files
+
+
+def _map(path: str) -> memoryview:
+    with open(path, "rb") as fd:
+        if not os.fstat(fd.fileno()).st_size:
+            return _EMPTY
+        return memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != "posix":
+        return True  # can't tell, left to the age check
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+class DiskCache(LoopBound):
+    """
+    downloads are streamed to a temporary file and renamed once complete, so a file in the cache
+    is always whole; reads return read-only memory-mapped views of it.
+    concurrent requests for the same key share one download
+    """
+
+    def __init__(self, directory: str, max_size=256 << 20, buffer_size=1 << 18, *, stale_part=3600.0, loop=None):
+        """
+        :param max_size: bytes the cached files may take on disk
+        :param buffer_size: bytes buffered in memory before being written out while downloading
+        :param stale_part: seconds after which a temporary file is removed even if the process
+        writing it is still alive, e.g. a recycled pid
+        """
+        super().__init__(loop)
+        self.directory = directory
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+        self.stale_part = stale_part
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, least recently used first
+        self._size = 0
+        self._pending: Dict[str, asyncio.Task] = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evicted = 0
+        self._load()
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def coalesced(self) -> int:
+        return self._coalesced
+
+    @property
+    def evicted(self) -> int:
+        return self._evicted
+
+    @property
+    def size(self) -> int:
+        """bytes taken by the cached files"""
+        return self._size
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key: str):
+        return self._digest(key) in self._files
+
+    def _load(self):
+        # files left by a previous run, oldest access first
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".part"):
+                self._clean_part(entry)
+                continue
+            if not _DIGEST.fullmatch(entry.name):
+                continue  # not ours, never indexed nor evicted
+            stat = entry.stat()
+            found.append((stat.st_atime, entry.name, stat.st_size))
+        for _, digest, size in sorted(found):
+            self._files[digest] = size
+            self._size += size
+        self._evict()
+
+    def _clean_part(self, entry: os.DirEntry):
+        # other processes may share the directory, only remove what an exited (or stuck) one left
+        pid = entry.name.rsplit(".", 2)[-2]
+        try:
+            alive = pid.isdigit() and _pid_alive(int(pid))
+            if alive and time.time() - entry.stat().st_mtime < self.stale_part:
+                return
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            pass  # finished or removed meanwhile
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, self._digest(key))
+
+    async def get(self, key: str, url: str) -> memoryview:
+        """:return the content of key, downloaded from url unless cached"""
+        digest = self._digest(key)
+        if digest in self._files:
+            try:
+                view = _map(os.path.join(self.directory, digest))
+            except FileNotFoundError:  # removed behind our back
+                self._forget(digest)
+            else:
+                self._hits += 1
+                self._files.move_to_end(digest)
+                return view
+        task = self._pending.get(digest)
+        if task is not None:
+            self._coalesced += 1
+        else:
+            self._misses += 1
+            task = self._loop.create_task(self._download(digest, url))
+            task.add_done_callback(functools.partial(self._done, digest))
+            self._pending[digest] = task
+        # a cancelled caller must not cancel the download other callers wait for
+        return await asyncio.shield(task)
+
+    def discard(self, key: str):
+        digest = self._digest(key)
+        if digest in self._files:
+            self._remove(digest)
+
+    def clear(self):
+        for digest in list(self._files):
+            self._remove(digest)
+
+    def _done(self, digest: str, task: asyncio.Task):
+        if self._pending.get(digest) is task:
+            del self._pending[digest]
+        if not task.cancelled():
+            task.exception()  # retrieved, callers may all be gone
+
+    async def _download(self, digest: str, url: str) -> memoryview:
+        import aiohttp
+
+        path = os.path.join(self.directory, digest)
+        part = f"{path}.{os.getpid()}.part"
+        loop = self._loop
+        async with aiohttp.request("GET", url) as resp:
+            if resp.status != 200:
+                raise ConnectionError(resp.status, await resp.text())
+            fd = await loop.run_in_executor(None, open, part, "wb")
+            try:
+                writer = AsyncFileWriter(fd, 0, self.buffer_size, loop=loop)
+                try:
+                    async for chunk in resp.content.iter_chunked(1 << 16):
+                        await writer.write(chunk)
+                finally:
+                    await writer.close()
+            except BaseException:
+                await loop.run_in_executor(None, fd.close)
+                os.unlink(part)
+                raise
+            await loop.run_in_executor(None, fd.close)
+        os.replace(part, path)
+        if digest in self._files:
+            self._forget(digest)
+        self._files[digest] = writer.committed
+        self._size += writer.committed
+        self._evict(keep=digest)
+        return _map(path)
+
+    def _forget(self, digest: str):
+        self._size -= self._files.pop(digest)
+
+    def _remove(self, digest: str):
+        self._forget(digest)
+        try:
+            # views already returned stay valid, the mapping outlives the name
+            os.unlink(os.path.join(self.directory, digest))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"cannot remove cached file {digest}: {e}")
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._size > self.max_size and self._files:
+            digest = next(iter(self._files))
+            if digest == keep:
+                if len(self._files) == 1:
+                    break  # larger than the whole cache, kept until the next one comes in
+                self._files.move_to_end(digest)
+                continue
+            self._remove(digest)
+            self._evicted += 1
@@ -1,3 +1,40 @@
 __all__ = ["events"]
 
-from .events import *
+import importlib
+from typing import Dict, Optional, Type
+
+# event classes are resolved on first use, importing ``events`` (~50 models) is deferred until then
+_resolved: Dict[str, Optional[Type]] = {}
+
+
+def _events():
+    return importlib.import_module(".events", __name__)
+
+
+def get_event(name: str) -> Optional[Type]:
+    """:return the event model registered as ``name``, or None if it's not an event"""
+    try:
+        return _resolved[name]
+    except KeyError:
+        pass
+    module = _events()
+    obj = getattr(module, name, None)
+    if not (isinstance(obj, type) and obj.__module__ == module.__name__ and not name.startswith("_")):
+        obj = None
+    _resolved[name] = obj
+    return obj
+
+
+def __getattr__(name: str):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    if name == "events":
+        return _events()
+    try:
+        return getattr(_events(), name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+
+def __dir__():
+    return sorted(set(globals()) | set(dir(_events())))
@@ -263,3 +263,14 @@ class MemberJoinRequestEvent(NewRequestEvent):
 class BotInvitedJoinGroupRequestEvent(NewRequestEvent):
     type = "BotInvitedJoinGroupRequestEvent"
     groupName: str
+
+
+class FloodEvent(BaseModel):
+    """not sent by the server, emitted by :class:`ela.flood.FloodDetector`"""
+    type = "FloodEvent"
+    detector: str
+    messageType: str
+    groupId: Optional[int]
+    fromId: int
+    count: int
+    window: float
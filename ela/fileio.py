@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+from typing import BinaryIO, Optional
+
+from .runtime import LoopBound
+
+
+def sha1_file(path: str, block_size=1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as fd:
+        for block in iter(lambda: fd.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AsyncFileWriter(LoopBound):
+    """
+    buffers chunks and writes them to ``fd`` from the default executor,
+    the next buffer fills up while the previous one is being written
+    """
+
+    def __init__(self, fd: BinaryIO, offset=0, buffer_size=1 << 20, *, loop=None):
+        self._fd = fd
+        super().__init__(loop)
+        self._offset = offset
+        self._buffer = bytearray()
+        self._buffer_size = buffer_size
+        self._pending: Optional[asyncio.Future] = None
+        self._committed = offset
+
+    @property
+    def committed(self) -> int:
+        """end offset of the data already on disk"""
+        return self._committed
+
+    def _write_at(self, offset: int, data: bytes):
+        self._fd.seek(offset)
+        self._fd.write(data)
+
+    async def _wait_pending(self):
+        if self._pending:
+            pending, self._pending = self._pending, None
+            self._committed = await pending
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        if len(self._buffer) >= self._buffer_size:
+            await self.flush()
+
+    async def flush(self):
+        await self._wait_pending()
+        if not self._buffer:
+            return
+        data, offset = bytes(self._buffer), self._offset
+        self._buffer.clear()
+        self._offset += len(data)
+        end = self._offset
+        self._pending = self._loop.run_in_executor(
+            None, lambda: self._write_at(offset, data) or end
+        )
+
+    async def close(self):
+        """flush the remaining data, the file object is left open"""
+        await self.flush()
+        await self._wait_pending()
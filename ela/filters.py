@@ -0,0 +1,61 @@
+"""
+filters evaluated on raw frames, before any model is built
+"""
+from typing import Optional, Callable, Iterable, Union
+
+from .component.group import Permission
+
+_LEVELS = [Permission.Member.value, Permission.Administrator.value, Permission.Owner.value]
+
+
+def group_id(data: dict) -> Optional[int]:
+    """:return the group a raw message or event frame belongs to"""
+    sender = data.get("sender")
+    if sender and "group" in sender:
+        return sender["group"]["id"]
+    group = data.get("group")
+    if group:
+        return group["id"]
+    member = data.get("member") or data.get("operator")
+    if member and "group" in member:
+        return member["group"]["id"]
+    return data.get("groupId") or None
+
+
+def sender_id(data: dict) -> Optional[int]:
+    """:return the user who caused a raw message or event frame"""
+    sender = data.get("sender") or data.get("member") or data.get("friend")
+    if sender:
+        return sender["id"]
+    return data.get("fromId")
+
+
+def permission(data: dict) -> Optional[str]:
+    sender = data.get("sender") or data.get("member")
+    return sender.get("permission") if sender else None
+
+
+def compile_filter(
+        groups: Iterable[int] = None,
+        senders: Iterable[int] = None,
+        min_permission: Union[Permission, str] = None
+) -> Optional[Callable[[dict], bool]]:
+    """
+    :return a predicate over raw frames, None when there is nothing to filter
+    """
+    checks = []
+    if groups is not None:
+        group_set = frozenset(int(i) for i in groups)
+        checks.append(lambda data: group_id(data) in group_set)
+    if senders is not None:
+        sender_set = frozenset(int(i) for i in senders)
+        checks.append(lambda data: sender_id(data) in sender_set)
+    if min_permission is not None:
+        level = _LEVELS.index(Permission(min_permission).value)
+        allowed = frozenset(_LEVELS[level:])
+        checks.append(lambda data: permission(data) in allowed)
+    if not checks:
+        return None
+    elif len(checks) == 1:
+        return checks[0]
+    return lambda data: all(check(data) for check in checks)
@@ -0,0 +1,160 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .filters import group_id, sender_id
+
+logger = logging.getLogger(__name__)
+
+_COUNT_MAX = 0xFFFF
+
+
+class FloodDetector:
+    """
+    a middleware counting inbound messages per (group, sender) over a sliding window of ``window`` seconds,
+    approximated by ``buckets`` fixed slots. a sender going over ``threshold`` messages within the window
+    makes a :class:`ela.event.events.FloodEvent` to be emitted, at most once per window.
+
+    counters live in flat arrays (a few dozen bytes per key), a key idle for a whole window is evicted,
+    and at most ``max_keys`` keys are tracked (the least recently seen is evicted first);
+    each message costs O(buckets) at worst, independent of the number of keys
+    """
+
+    def __init__(
+            self,
+            window=10.0,
+            threshold=10,
+            *, buckets=10,
+            max_keys=1 << 20,
+            types: Iterable[str] = ("GroupMessage", "FriendMessage", "TempMessage"),
+            drop=False,
+            name="flood",
+            clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        :param drop: don't pass messages of a flooding sender down the chain
+        :param name: reported as FloodEvent.detector, to tell several detectors apart
+        """
+        if buckets < 1 or window <= 0:
+            raise ValueError("window and buckets must be positive")
+        self.window = window
+        self.threshold = threshold
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self.types = frozenset(types)
+        self.drop = drop
+        self.name = name
+        self._clock = clock
+        self._span = window / buckets
+        self._zeros = array("H", [0]) * buckets
+
+        self._slots: "OrderedDict[int, int]" = OrderedDict()  # key -> slot, least recently seen first
+        self._free: List[int] = []
+        self._counts = array("H")  # buckets counters per slot
+        self._total = array("L")
+        self._stamp = array("q")  # tick of the newest counter per slot
+        self._quiet = array("q")  # tick before which the slot isn't reported again
+
+        self.evicted = 0
+        self.reported = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    @staticmethod
+    def key(group: Optional[int], sender: int) -> int:
+        # one int instead of a tuple, qq and group numbers stay far below 2 ** 48
+        return (group or 0) << 48 | sender
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if len(self._slots) >= self.max_keys:
+            _, slot = self._slots.popitem(last=False)
+            self.evicted += 1
+            return slot
+        slot = len(self._total)
+        self._counts.extend(self._zeros)
+        self._total.append(0)
+        self._stamp.append(0)
+        self._quiet.append(0)
+        return slot
+
+    def _evict_idle(self, tick: int):
+        slots, stamp = self._slots, self._stamp
+        while slots:
+            key, slot = next(iter(slots.items()))
+            if tick - stamp[slot] < self.buckets:
+                break
+            del slots[key]
+            self._free.append(slot)
+            self.evicted += 1
+
+    def hit(self, key: int) -> Tuple[int, bool]:
+        """
+        count a message of key
+        :return (messages within the window, whether a flood should be reported now)
+        """
+        buckets = self.buckets
+        counts, total, stamp = self._counts, self._total, self._stamp
+        tick = int(self._clock() / self._span)
+        slot = self._slots.get(key)
+        if slot is None:
+            self._evict_idle(tick)
+            slot = self._allocate()
+            self._slots[key] = slot
+            base = slot * buckets
+            for i in range(base, base + buckets):
+                counts[i] = 0
+            total[slot] = 0
+            stamp[slot] = tick
+            self._quiet[slot] = 0
+        else:
+            self._slots.move_to_end(key)
+            base = slot * buckets
+            age = tick - stamp[slot]
+            if age >= buckets:
+                for i in range(base, base + buckets):
+                    counts[i] = 0
+                total[slot] = 0
+            else:
+                for t in range(stamp[slot] + 1, tick + 1):
+                    i = base + t % buckets
+                    total[slot] -= counts[i]
+                    counts[i] = 0
+            stamp[slot] = tick
+            self._evict_idle(tick)
+
+        i = base + tick % buckets
+        if counts[i] < _COUNT_MAX:
+            counts[i] += 1
+            total[slot] += 1
+        count = total[slot]
+        if count > self.threshold and tick >= self._quiet[slot]:
+            self._quiet[slot] = tick + buckets
+            self.reported += 1
+            return count, True
+        return count, False
+
+    async def __call__(self, app, data_type: str, data: dict, call_next):
+        if data_type in self.types:
+            sender = sender_id(data)
+            if sender is not None:
+                group = group_id(data)
+                count, report = self.hit(self.key(group, sender))
+                if report:
+                    logger.info(f"{self.name}: {sender} sent {count} messages in {self.window}s (group {group})")
+                    await app.emit({
+                        "type": "FloodEvent",
+                        "detector": self.name,
+                        "messageType": data_type,
+                        "groupId": group,
+                        "fromId": sender,
+                        "count": count,
+                        "window": self.window
+                    })
+                if self.drop and count > self.threshold:
+                    return
+        await call_next(data_type, data)
@@ -0,0 +1,120 @@
+"""
+flyweight pool of Group and Member objects: messages and events of the same group share one Group,
+those of the same member share one Member. a pooled object is updated in place when a newer frame
+carries different fields, so every message still referencing it sees the member as it is now
+"""
+from collections import OrderedDict
+from typing import Dict, Tuple, Callable, Any
+
+from .component.group import Group, Member, Permission
+
+_GROUP_FIELDS = ("name", "permission")
+_MEMBER_FIELDS = ("memberName", "specialTitle", "joinTimestamp", "lastSpeakTimestamp", "muteTimeRemaining", "permission")
+_SLOTS = ("sender", "member", "operator", "group")
+
+
+def _merge(cached, fresh, fields) -> bool:
+    old, new = cached.__dict__, fresh.__dict__
+    changed = False
+    for name in fields:
+        value = new[name]
+        if old[name] != value:
+            old[name] = value
+            changed = True
+    return changed
+
+
+class InternPool:
+    def __init__(self, max_members=65536):
+        self.max_members = max_members
+        self._groups: Dict[int, Group] = {}
+        self._members: "OrderedDict[Tuple[int, int], Member]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    def __len__(self):
+        return len(self._groups) + len(self._members)
+
+    def get_group(self, group_id: int) -> Group:
+        return self._groups.get(group_id)
+
+    def get_member(self, group_id: int, member_id: int) -> Member:
+        return self._members.get((group_id, member_id))
+
+    def group(self, group: Group) -> Group:
+        """:return the pooled Group of group.id, updated with the fields of group"""
+        cached = self._groups.get(group.id)
+        if cached is None:
+            self.misses += 1
+            self._groups[group.id] = group
+            return group
+        self.hits += 1
+        if cached is not group and _merge(cached, group, _GROUP_FIELDS):
+            self.updates += 1
+        return cached
+
+    def member(self, member: Member) -> Member:
+        """:return the pooled Member of (member.group.id, member.id), updated with the fields of member"""
+        group = self.group(member.group)
+        key = (group.id, member.id)
+        cached = self._members.get(key)
+        if cached is None:
+            self.misses += 1
+            member.__dict__["group"] = group
+            self._members[key] = member
+            if len(self._members) > self.max_members:
+                self._members.popitem(last=False)
+            return member
+        self.hits += 1
+        self._members.move_to_end(key)
+        if cached is not member and _merge(cached, member, _MEMBER_FIELDS):
+            self.updates += 1
+        return cached
+
+    def forget_member(self, group_id: int, member_id: int):
+        self._members.pop((group_id, member_id), None)
+
+    def forget_group(self, group_id: int):
+        self._groups.pop(group_id, None)
+        for key in [key for key in self._members if key[0] == group_id]:
+            del self._members[key]
+
+    def intern(self, obj):
+        """swap the Group and Member fields of a message or event for pooled ones, apply reported changes"""
+        fields = obj.__dict__
+        for name in _SLOTS:
+            value = fields.get(name)
+            if isinstance(value, Member):
+                fields[name] = self.member(value)
+            elif isinstance(value, Group):
+                fields[name] = self.group(value)
+        apply = _CHANGES.get(type(obj).__name__)
+        if apply:
+            apply(self, obj)
+        return obj
+
+
+def _set(path: str, field: str, value: Callable[[Any], Any]):
+    def apply(pool: InternPool, ev):
+        target = getattr(ev, path)
+        target.__dict__[field] = value(ev)
+        pool.updates += 1
+
+    return apply
+
+
+# events whose payload describes a change the pooled objects may not carry yet
+_CHANGES: Dict[str, Callable[[InternPool, Any], None]] = {
+    "GroupNameChangeEvent": _set("group", "name", lambda ev: ev.current),
+    "BotGroupPermissionChangeEvent": _set("group", "permission", lambda ev: ev.current),
+    "MemberCardChangeEvent": _set("member", "memberName", lambda ev: ev.current),
+    "MemberSpecialTitleChangeEvent": _set("member", "specialTitle", lambda ev: ev.current),
+    "MemberPermissionChangeEvent": _set("member", "permission", lambda ev: Permission(ev.current)),
+    "MemberMuteEvent": _set("member", "muteTimeRemaining", lambda ev: ev.durationSeconds),
+    "MemberUnmuteEvent": _set("member", "muteTimeRemaining", lambda ev: 0),
+    "MemberLeaveEventKick": lambda pool, ev: pool.forget_member(ev.member.group.id, ev.member.id),
+    "MemberLeaveEventQuit": lambda pool, ev: pool.forget_member(ev.member.group.id, ev.member.id),
+    "BotLeaveEventActive": lambda pool, ev: pool.forget_group(ev.group.id),
+    "BotLeaveEventKick": lambda pool, ev: pool.forget_group(ev.group.id),
+}
@@ -0,0 +1,183 @@
+"""
+keyword matching with Aho-Corasick automata: every keyword of a list is found in a single pass over the text.
+automata are built lazily and per group, a changed list only rebuilds its own automaton
+"""
+from collections import deque
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Set
+
+GLOBAL = None  # the group key of keywords applying everywhere
+
+
+class KeywordMatch:
+    __slots__ = ["keyword", "payloads", "element", "start", "end"]
+
+    def __init__(self, keyword: str, payloads: tuple, element: int, start: int, end: int):
+        self.keyword = keyword
+        self.payloads = payloads
+        self.element = element  # index of the Plain element in the chain
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"<KeywordMatch '{self.keyword}' element={self.element} span=({self.start}, {self.end})>"
+
+
+class Automaton:
+    def __init__(self, keywords: Dict[str, tuple], ignore_case=False):
+        """:param keywords: keyword -> payloads reported with its matches"""
+        self.ignore_case = ignore_case
+        self._keywords: List[Tuple[str, tuple, int]] = []  # keyword, payloads, length as matched
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        out: List[List[int]] = [[]]
+
+        for keyword, payloads in keywords.items():
+            if not keyword:
+                continue
+            state = 0
+            pattern = keyword.casefold() if ignore_case else keyword
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    out.append([])
+                state = nxt
+            out[state].append(len(self._keywords))
+            self._keywords.append((keyword, tuple(payloads), len(pattern)))
+
+        # breadth first, so the failure state of a parent is known before its children
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[child] = fail if fail != child else 0
+                out[child].extend(out[self._fail[child]])
+        self._out: List[Tuple[int, ...]] = [tuple(o) for o in out]
+
+    def __len__(self):
+        return len(self._keywords)
+
+    def find(self, text: str) -> List[Tuple[int, int, str, tuple]]:
+        """
+        :return (start, end, keyword, payloads) of every occurrence, overlapping ones included.
+        offsets are in text, also when ignoring case
+        """
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self._keywords
+        origin = None
+        if self.ignore_case:
+            folded = text.casefold()
+            if len(folded) != len(text):
+                # some characters fold to several (e.g. "ß" to "ss"), map offsets back to text
+                origin = [i for i, ch in enumerate(text) for _ in ch.casefold()]
+                origin.append(len(text))
+            text = folded
+        found = []
+        state = 0
+        for pos, ch in enumerate(text):
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt or 0
+            if out[state]:
+                for index in out[state]:
+                    keyword, payloads, length = keywords[index]
+                    if origin is None:
+                        found.append((pos + 1 - length, pos + 1, keyword, payloads))
+                    else:
+                        found.append((origin[pos + 1 - length], origin[pos] + 1, keyword, payloads))
+        return found
+
+
+class KeywordEngine:
+    """
+    keyword lists per group (``GLOBAL`` for all of them), each keyword carrying a set of payloads.
+    a message of a group is matched against the global automaton and the group's one
+    """
+
+    def __init__(self, ignore_case=False):
+        self.ignore_case = ignore_case
+        self._lists: Dict[Hashable, Dict[str, Set[Any]]] = {}
+        self._automata: Dict[Hashable, Optional[Automaton]] = {}  # None marks a list changed since built
+        self.builds = 0
+
+    def add(self, keyword: str, payload: Any = None, group: Optional[int] = GLOBAL):
+        self._lists.setdefault(group, {}).setdefault(keyword, set()).add(payload)
+        self._automata[group] = None
+
+    def remove(self, keyword: str, payload: Any = None, group: Optional[int] = GLOBAL):
+        """:param payload: None to remove the keyword with all its payloads"""
+        words = self._lists.get(group)
+        if not words or keyword not in words:
+            return
+        if payload is None:
+            del words[keyword]
+        else:
+            words[keyword].discard(payload)
+            if not words[keyword]:
+                del words[keyword]
+        self._automata[group] = None
+
+    def replace(self, keywords: Iterable[str], payload: Any = None, group: Optional[int] = GLOBAL):
+        """replace the whole keyword list of group with keywords all carrying payload"""
+        self._lists[group] = {keyword: {payload} for keyword in keywords}
+        self._automata[group] = None
+
+    def keywords(self, group: Optional[int] = GLOBAL) -> List[str]:
+        return list(self._lists.get(group, ()))
+
+    def _automaton(self, group) -> Optional[Automaton]:
+        try:
+            automaton = self._automata[group]
+        except KeyError:
+            return None
+        if automaton is None:
+            words = self._lists.get(group)
+            automaton = Automaton(
+                {keyword: tuple(payloads) for keyword, payloads in words.items()}, self.ignore_case
+            ) if words else None
+            self.builds += 1
+            if automaton is None:
+                del self._automata[group]
+                self._lists.pop(group, None)
+                return None
+            self._automata[group] = automaton
+        return automaton
+
+    def rebuild(self):
+        """build every changed automaton now instead of on the next match"""
+        for group in list(self._automata):
+            self._automaton(group)
+
+    def _match(self, texts: Iterable[Tuple[int, str]], group: Optional[int]) -> List[KeywordMatch]:
+        automata = [self._automaton(GLOBAL)]
+        if group is not None:
+            automata.append(self._automaton(group))
+        automata = [automaton for automaton in automata if automaton]
+        if not automata:
+            return []
+        matches = []
+        for element, text in texts:
+            for automaton in automata:
+                for start, end, keyword, payloads in automaton.find(text):
+                    matches.append(KeywordMatch(keyword, payloads, element, start, end))
+        return matches
+
+    def match(self, texts: Iterable[str], group: Optional[int] = None) -> List[KeywordMatch]:
+        """:param texts: Plain texts of a chain, KeywordMatch.element indexes them"""
+        return self._match(enumerate(texts), group)
+
+    def match_chain(self, chain: List[dict], group: Optional[int] = None) -> List[KeywordMatch]:
+        """match the Plain elements of a raw message chain, KeywordMatch.element indexes the chain"""
+        return self._match(
+            ((element, item["text"]) for element, item in enumerate(chain) if item.get("type") == "Plain"),
+            group
+        )
@@ -1,8 +1,15 @@
+import atexit
+import copy
 import logging
 import os
+import random
 import sys
+import time
+from collections import OrderedDict
 from logging import StreamHandler, LogRecord
-from typing import Optional, List
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Optional, List, Dict, Tuple
 
 _color_mapper = {
     0: "\33[34m",  # NOTSET blue
@@ -30,6 +37,71 @@ class ColoredStreamHandler(StreamHandler):
             self.handleError(record)
 
 
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # arguments are merged here, they may change before the listener thread gets to the record;
+        # the rest of the formatting (time, level, traceback) is left to the listener
+        record = copy.copy(record)
+        record.template = record.msg  # what RateLimitFilter keys on, on the listener side
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    let at most ``rate`` records with the same message template through every ``per`` seconds,
+    the first record after a suppression notes how many were dropped
+    """
+
+    def __init__(self, rate: int = 10, per: float = 1.0, max_keys: int = 1024):
+        """:param max_keys: templates tracked at most, the least recently logged is forgotten first"""
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        # key -> [window start, count, dropped], least recently logged first
+        self._window: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+
+    def filter(self, record: LogRecord) -> bool:
+        now = time.monotonic()
+        key = (record.name, str(getattr(record, "template", record.msg)))
+        state = self._window.get(key)
+        if state is None:
+            if len(self._window) >= self.max_keys:
+                self._window.popitem(last=False)
+        else:
+            self._window.move_to_end(key)
+        if state is None or now - state[0] >= self.per:
+            dropped = state[2] if state else 0
+            self._window[key] = [now, 1, 0]
+            if dropped:
+                record.msg = f"{record.msg} ({int(dropped)} similar messages suppressed)"
+            return True
+        if state[1] < self.rate:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+class SampleFilter(logging.Filter):
+    """pass roughly ``rate`` (0.0 - 1.0) of the records, records at or above ``keep_level`` always pass"""
+
+    def __init__(self, rate: float, keep_level: int = logging.ERROR):
+        super().__init__()
+        self.rate = rate
+        self.keep_level = keep_level
+
+    def filter(self, record: LogRecord) -> bool:
+        return record.levelno >= self.keep_level or random.random() < self.rate
+
+
+def _stop_listener(listener: QueueListener):
+    if listener._thread is not None:  # stop() isn't idempotent before 3.12
+        listener.stop()
+
+
 # https://github.com/django/django/blob/main/django/core/management/color.py
 def supported_color() -> bool:
     """
@@ -78,8 +150,13 @@ def initial_logger(
         enable_log_color=True,
         log_fmt: str = None,
         datefmt: Optional[str] = None,
-        handlers: List[logging.Handler] = None
-):
+        handlers: List[logging.Handler] = None,
+        queued: bool = False
+) -> Optional[QueueListener]:
+    """
+    :param queued: hand records to a background thread, which does the formatting and I/O
+    :return the started QueueListener in queued mode, it is stopped at exit
+    """
     if handlers is None:
         handlers = []
     if log_fmt is None:
@@ -88,4 +165,16 @@ def initial_logger(
         handlers.append(ColoredStreamHandler())
     elif not handlers:
         handlers.append(logging.StreamHandler())
-    logging.basicConfig(level=level, handlers=handlers, datefmt=datefmt, format=log_fmt)
+    if not queued:
+        logging.basicConfig(level=level, handlers=handlers, datefmt=datefmt, format=log_fmt)
+        return None
+    formatter = logging.Formatter(log_fmt, datefmt)
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(formatter)
+    queue = SimpleQueue()
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    logging.basicConfig(level=level, handlers=[_DeferredQueueHandler(queue)])
+    return listener
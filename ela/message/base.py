@@ -1,9 +1,8 @@
 from abc import abstractmethod
 from enum import Enum
 from pathlib import Path
-from typing import Optional, Type, BinaryIO
+from typing import Optional, Type, BinaryIO, Union
 
-import aiohttp
 from pydantic import BaseModel, HttpUrl
 
 
@@ -40,11 +39,20 @@ class RemoteResource(BaseModel):
     path: Optional[Path]
     base64: Optional[str]
 
-    async def get_file_from_url(self) -> bytes:
+    async def get_file_from_url(self, cache=None) -> Union[bytes, memoryview]:
+        """
+        :param cache: a :class:`ela.diskcache.DiskCache`, the file is then downloaded once
+        and returned as a read-only memory-mapped view
+        """
+        if cache is not None:
+            return await cache.get(getattr(self, "imageId", None) or str(self.url), self.url)
+
+        import aiohttp
+
         async with aiohttp.request("GET", self.url) as resp:
             if resp.status != 200:
                 raise ConnectionError(resp.status, await resp.text())
-            return await resp.content.readexactly(resp.content_length)
+            return await resp.read()
 
     @classmethod
     @abstractmethod
@@ -89,6 +97,8 @@ class UnpreparedResource(Unprepared):
 
     @staticmethod
     async def upload(network, action: str, utype: str, io: BinaryIO, file_type: str, **extra_field) -> dict:
+        import aiohttp
+
         form = aiohttp.FormData()
         form.add_field("sessionKey", network.session_key)
         form.add_field("type", utype)
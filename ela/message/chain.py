@@ -1,7 +1,8 @@
+import asyncio
 import time
 from typing import List, Union, Type, Optional, Any, Tuple, Generator, Iterable
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Field, validator
 
 from .base import MessageModel, RemoteResource, MessageModelTypes, Unprepared, UniqueModel
 from .models import message_model, Source
@@ -111,31 +112,51 @@ class MessageNode(BaseModel):
 
 
 class ForwardMessage(Unprepared):
-    def __init__(self, chain: Optional[List[Tuple[int, str, Union[list, int]]]] = None):
+    def __init__(self, chain: Optional[List[Tuple[int, str, Union[list, int]]]] = None, *, concurrency=8):
         """
         chain format:
         [
             (uin, name, msg_id), # or
             (uin, name, MessageChain)
         ]
+        :param concurrency: number of resources in nested chains prepared at the same time
         """
-        self._raw_chain = chain
+        self._raw_chain = list(chain) if chain else []
+        self._concurrency = concurrency
+
+    def add(self, uin: int, name: str, data: Union[list, MessageChain, int]) -> "ForwardMessage":
+        self._raw_chain.append((uin, name, data))
+        return self
+
+    def __len__(self):
+        return len(self._raw_chain)
 
     async def prepare(self, network, utype) -> "Forward":
+        sem = asyncio.Semaphore(self._concurrency)
+
+        async def prepare_one(component: Unprepared):
+            async with sem:
+                return await component.prepare(network, utype)
+
+        # resources of every node are prepared together instead of one node after another
+        unprepared = [
+            (i, j, component)
+            for i, (_, _, data) in enumerate(self._raw_chain) if isinstance(data, list)
+            for j, component in enumerate(data) if isinstance(component, Unprepared)
+        ]
+        prepared = await asyncio.gather(*(prepare_one(c) for _, _, c in unprepared))
+        replaced = {(i, j): model for (i, j, _), model in zip(unprepared, prepared)}
+
         msg = Forward()
-        for node in self._raw_chain:
-            uin, name, data = node
-            print(node)
+        for i, (uin, name, data) in enumerate(self._raw_chain):
             if isinstance(data, int):
                 msg.create_node(uin, message_id=data, name=name)
+            elif isinstance(data, MessageChain):
+                msg.create_node(uin, chain=data, name=name)
             elif isinstance(data, list):
-                chain = []
-                for component in data:
-                    if isinstance(component, Unprepared):
-                        chain.append(await component.prepare(network, utype))
-                    else:
-                        chain.append(component)
-                msg.create_node(uin, chain=chain, name=name)
+                if replaced:
+                    data = [replaced.get((i, j), component) for j, component in enumerate(data)]
+                msg.create_node(uin, chain=data, name=name)
             else:
                 raise TypeError(data)
         return msg
@@ -143,7 +164,7 @@ class ForwardMessage(Unprepared):
 
 class Forward(UniqueModel):
     type = MessageModelTypes.Forward
-    nodeList: List[MessageNode] = []
+    nodeList: List[MessageNode] = Field(default_factory=list)
 
     def create_node(self,
                     sender_id: int,
@@ -152,8 +173,11 @@ class Forward(UniqueModel):
         if time_ == -1:
             time_ = int(time.time())
         assert chain or message_id
+        if isinstance(chain, list):
+            chain = MessageChain(__root__=chain)
+        # the chain is already validated, building the node must not walk it again
         self.nodeList.append(
-            MessageNode(
+            MessageNode.construct(
                 senderId=sender_id,
                 time=time_,
                 senderName=name,
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 
 from ela.component.friend import Friend
 from ela.component.group import Member, Group
+from ..parser import parse
 from .base import Client
 from .chain import MessageChain
 from .models import Source
@@ -65,5 +66,5 @@ class MessageType(Enum):
         return item in cls.__members__
 
     @classmethod
-    def to_message(cls, name: str, data: dict) -> BaseMessageType:
-        return getattr(cls, name).value[0](**data)
+    def to_message(cls, name: str, data: dict, trusted: bool = None) -> BaseMessageType:
+        return parse(getattr(cls, name).value[0], data, trusted)
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+from typing import Dict, Callable, Optional
+
+from .component.group import File
+from .runtime import get_loop
+from .types import T
+
+logger = logging.getLogger(__name__)
+
+
+class SyncReport:
+    __slots__ = ["scanned", "downloaded", "skipped", "failed", "bytes", "started", "finished"]
+
+    def __init__(self):
+        self.scanned = 0
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """downloaded bytes per second"""
+        try:
+            return self.bytes / self.elapsed
+        except ZeroDivisionError:
+            return 0.0
+
+    def __repr__(self):
+        return (
+            f"<SyncReport scanned={self.scanned} downloaded={self.downloaded} skipped={self.skipped} "
+            f"failed={self.failed} bytes={self.bytes} throughput={self.throughput:.0f}B/s>"
+        )
+
+
+class GroupFileMirror:
+    """
+    mirrors the file space of a group into a local directory, the tree is crawled with bounded
+    concurrency and only files whose sha1 or lastModifyTime changed since the last sync are downloaded
+    """
+    manifest_name = ".ela-manifest.json"
+
+    def __init__(
+            self,
+            api,
+            group: T.Group,
+            root: str,
+            *, concurrency=4,
+            verify_file=False,
+            progress: Callable[[SyncReport, File], None] = None
+    ):
+        """
+        :type api: ela.api.API
+        :param progress: called after each file is handled
+        """
+        self._api = api
+        self._group = group
+        self._root = os.path.abspath(root)
+        self._concurrency = concurrency
+        self._verify_file = verify_file
+        self._progress = progress
+        self._manifest: Dict[str, dict] = {}
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self._root, self.manifest_name)
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"manifest {self.manifest_path} broken, doing a full sync")
+            return {}
+
+    def _save_manifest(self):
+        os.makedirs(self._root, exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fd:
+            json.dump(self._manifest, fd, ensure_ascii=False)
+        os.replace(tmp, self.manifest_path)
+
+    def _local_path(self, file: File) -> str:
+        path = os.path.abspath(os.path.join(self._root, file.path.lstrip("/")))
+        if os.path.commonpath([path, self._root]) != self._root:
+            raise ValueError(f"remote path {file.path} escapes the mirror root")
+        return path
+
+    def _entry(self, file: File, path: str) -> dict:
+        return {
+            "path": os.path.relpath(path, self._root),
+            "sha1": file.downloadInfo.sha1.lower(),
+            "lastModifyTime": file.downloadInfo.lastModifyTime.isoformat()
+        }
+
+    def _changed(self, file: File, entry: dict) -> bool:
+        old = self._manifest.get(file.id)
+        return old != entry or not os.path.isfile(os.path.join(self._root, entry["path"]))
+
+    async def sync(self) -> SyncReport:
+        report = SyncReport()
+        loop = get_loop()
+        sem = asyncio.Semaphore(self._concurrency)
+        self._manifest = await loop.run_in_executor(None, self._load_manifest)
+        seen: Dict[str, dict] = {}
+        failed = set()
+
+        async def fetch(file: File, entry: dict):
+            path = os.path.join(self._root, entry["path"])
+            await loop.run_in_executor(None, functools.partial(os.makedirs, os.path.dirname(path), exist_ok=True))
+            async with sem:
+                try:
+                    await file.download_file(path, self._verify_file)
+                except Exception:
+                    logger.exception(f"download {file.path} failed")
+                    report.failed += 1
+                    failed.add(file.id)
+                    return
+            report.downloaded += 1
+            report.bytes += await loop.run_in_executor(None, os.path.getsize, path)
+
+        async def crawl(parent_id: str):
+            async with sem:
+                listing = await self._api.fileList(self._group, parent_id)
+            pending = []
+            for file in listing:
+                if file.isDirectory:
+                    pending.append(crawl(file.id))
+                    continue
+                report.scanned += 1
+                if not file.downloadInfo:
+                    logger.warning(f"{file.path} has no download info, skip")
+                    report.failed += 1
+                    continue
+                try:
+                    path = self._local_path(file)
+                except ValueError as e:
+                    # a single bad name doesn't stop the sync
+                    logger.warning(f"{e}, skip")
+                    report.failed += 1
+                    continue
+                entry = self._entry(file, path)
+                seen[file.id] = entry
+                if self._changed(file, entry):
+                    pending.append(self._notify(fetch(file, entry), report, file))
+                else:
+                    report.skipped += 1
+                    self._report(report, file)
+            await asyncio.gather(*pending)
+
+        complete = False
+        try:
+            await crawl("")
+            complete = True
+        finally:
+            report.finished = time.monotonic()
+            # failed downloads keep their old entry so they are retried next time,
+            # an interrupted crawl keeps everything it didn't reach
+            for file_id, entry in self._manifest.items():
+                if file_id in failed:
+                    seen[file_id] = entry
+                elif not complete:
+                    seen.setdefault(file_id, entry)
+            for file_id in failed - self._manifest.keys():
+                seen.pop(file_id, None)
+            self._manifest = seen
+            await loop.run_in_executor(None, self._save_manifest)
+        logger.info(f"group {int(self._group)} synced: {report}")
+        return report
+
+    async def _notify(self, coro, report: SyncReport, file: File):
+        await coro
+        self._report(report, file)
+
+    def _report(self, report: SyncReport, file: File):
+        if self._progress:
+            try:
+                self._progress(report, file)
+            except Exception:
+                logger.exception("progress callback raise an error")
@@ -1,23 +1,27 @@
 import asyncio
 import json
 import logging
-from typing import Callable, Any, Optional
+from collections import deque
+from typing import Callable, Any, Optional, Deque, Tuple, TYPE_CHECKING
 from urllib import parse
 
-import aiohttp
+from . import tracing
+from .runtime import LoopBound
+
+if TYPE_CHECKING:
+    import aiohttp
 
 logger = logging.getLogger(__name__)
 
 
-class Network:
+class Network(LoopBound):
     def __init__(self, url: str, qq: int, verify_key: str, *, loop=None):
-        if not loop:
-            loop = asyncio.get_event_loop()
         self.url = url
         self.qq = qq
-        self._closed = asyncio.Event()
-        self._loop = loop
-        self._session = aiohttp.ClientSession(loop=loop)
+        super().__init__(loop)
+        self._closed_flag = False
+        self._closed_event: Optional[asyncio.Event] = None  # created by the first wait_closed
+        self.__session: Optional["aiohttp.ClientSession"] = None
         self.__verify_key = verify_key
         self.__session_key = None
         self.__running = True
@@ -27,6 +31,19 @@ class Network:
     def session_key(self) -> Optional[str]:
         return self.__session_key
 
+    def _use_session(self, session_key: str):
+        """adopt a session opened by another process, e.g. a :class:`ela.broker.Broker`"""
+        self.__session_key = session_key
+
+    @property
+    def _session(self) -> "aiohttp.ClientSession":
+        # aiohttp is heavy to import, defer it until the first request
+        if self.__session is None:
+            import aiohttp
+
+            self.__session = aiohttp.ClientSession(loop=self._loop)
+        return self.__session
+
     def __join_url(self, target: str, params: dict = None, *, with_key=False) -> str:
         if not params:
             params = {}
@@ -39,22 +56,33 @@ class Network:
 
     @property
     def closed(self) -> bool:
-        return self._closed.is_set()
+        return self._closed_flag
+
+    def _set_closed(self):
+        self._closed_flag = True
+        if self._closed_event is not None:
+            self._closed_event.set()
 
     async def close(self):
         self.__running = False
-        await self._session.close()
+        if self.__session is not None:
+            await self.__session.close()
         if not self.__session_key:
-            self._closed.set()
+            self._set_closed()
 
     async def wait_closed(self):
-        await self._closed.wait()
+        if self._closed_flag:
+            return
+        if self._closed_event is None:
+            self._closed_event = asyncio.Event()
+        await self._closed_event.wait()
 
     async def reset(self):
         if not self.closed:
             raise RuntimeError("cannot reset an active connection")
-        self._closed.clear()
-        self._session = aiohttp.ClientSession(loop=self._loop)
+        self._closed_flag = False
+        self._closed_event = None
+        self.__session = None
         self.__session_key = None
         self.__running = True
 
@@ -70,7 +98,9 @@ class Network:
     async def post(self, target: str, data: Any, params=None, **kwargs) -> dict:
         return await self._http_req("POST", self.__join_url(target, params, with_key=True), data=data, **kwargs)
 
-    async def _websocket_listen(self, ws: aiohttp.ClientWebSocketResponse, callback, name=None):
+    async def _websocket_listen(self, ws: "aiohttp.ClientWebSocketResponse", callback, name=None):
+        import aiohttp
+
         connected = False
         ping_count = 0
         while self.__running:
@@ -86,11 +116,19 @@ class Network:
                 continue
             if msg.type == aiohttp.WSMsgType.TEXT:
                 if connected:
-                    try:
-                        await callback(json.loads(msg.data))
-                    except:
-                        logger.exception(f"({name}): Callback raise an error")
-                        logger.debug(msg.data)
+                    with tracing.trace("inbound", ws=name) as root:
+                        try:
+                            with tracing.stage("decode"):
+                                pkg = json.loads(msg.data)
+                            if root is not None:
+                                if pkg.get("syncId") != "-1":
+                                    root.discard()  # a response, traced on the request side
+                                else:
+                                    root.set("type", pkg["data"].get("type"))
+                            await callback(pkg)
+                        except:
+                            logger.exception(f"({name}): Callback raise an error")
+                            logger.debug(msg.data)
                 else:
                     pkg = json.loads(msg.data)
                     if not pkg["syncId"]:
@@ -115,7 +153,7 @@ class Network:
     def __done_cb(self, context: asyncio.Task):
         self.__ws_count -= 1
         if self.__ws_count <= 0:
-            self._closed.set()
+            self._set_closed()
 
     async def websocket(self, target: str, callback: Callable, *, name=None):
         """:return aiohttp.ClientWebSocketResponse"""
@@ -128,3 +166,76 @@ class Network:
             self._websocket_listen(ws, callback, name)
         ).add_done_callback(self.__done_cb)
         return ws
+
+
+class FrameWriter(LoopBound):
+    """
+    sends outbound websocket frames from a single task: frames queued within the same
+    loop tick are written back to back as one batch, in the order they were queued
+    """
+
+    def __init__(self, ws: "aiohttp.ClientWebSocketResponse", *, loop=None):
+        self._ws = ws
+        super().__init__(loop)
+        self._queue: Deque[Tuple[str, Optional[asyncio.Future]]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+        self._batch_count = 0
+        self._frame_count = 0
+        self._max_batch = 0
+
+    @property
+    def batch_count(self) -> int:
+        return self._batch_count
+
+    @property
+    def frame_count(self) -> int:
+        return self._frame_count
+
+    @property
+    def max_batch(self) -> int:
+        return self._max_batch
+
+    @property
+    def average_batch(self) -> float:
+        try:
+            return self._frame_count / self._batch_count
+        except ZeroDivisionError:
+            return 0.0
+
+    @property
+    def closed(self) -> bool:
+        return self._task.done()
+
+    def write(self, data: str, waiter: Optional[asyncio.Future] = None):
+        """queue a frame, a failed write is reported through waiter"""
+        if self.closed:
+            raise RuntimeError("writer closed")
+        self._queue.append((data, waiter))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._queue = self._queue, deque()
+            self._batch_count += 1
+            self._frame_count += len(batch)
+            if len(batch) > self._max_batch:
+                self._max_batch = len(batch)
+            for data, waiter in batch:
+                try:
+                    await self._ws.send_str(data)
+                except Exception as e:
+                    if waiter and not waiter.done():
+                        waiter.set_exception(e)
+                    else:
+                        logger.exception("frame write failed")
+
+    def close(self):
+        self._task.cancel()
+        while self._queue:
+            _, waiter = self._queue.popleft()
+            if waiter and not waiter.done():
+                waiter.set_exception(ConnectionError("writer closed"))
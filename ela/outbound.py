@@ -0,0 +1,183 @@
+"""
+outbound text shaping: merging small Plain-only sends and splitting oversized chains
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .message.base import UniqueModel
+from .message.models import Plain, Source
+from .priority import Priority
+from .runtime import LoopBound
+
+logger = logging.getLogger(__name__)
+
+# characters of plain text per message, a bit below what the server accepts
+DEFAULT_MAX_LENGTH = 4000
+
+Key = Tuple  # ("group", id) / ("friend", id) / ("temp", group, qq)
+
+
+def is_plain(chain: Iterable) -> bool:
+    """:return True if chain holds nothing but Plain elements (and a Source)"""
+    found = False
+    for item in chain:
+        if isinstance(item, Plain):
+            found = True
+        elif not isinstance(item, Source):
+            return False
+    return found
+
+
+def plain_text(chain: Iterable) -> str:
+    return "".join(item.text for item in chain if isinstance(item, Plain))
+
+
+def _cut_point(text: str, limit: int) -> int:
+    """:return where to cut text so the head is at most limit long, preferring line then word boundaries"""
+    cut = text.rfind("\n", 0, limit)
+    if cut > limit // 2:
+        return cut + 1
+    cut = max(text.rfind(" ", 0, limit), text.rfind("\t", 0, limit))
+    if cut > limit // 2:
+        return cut + 1
+    return limit
+
+
+def split_text(text: str, max_length=DEFAULT_MAX_LENGTH) -> List[str]:
+    parts = []
+    while len(text) > max_length:
+        cut = _cut_point(text, max_length)
+        parts.append(text[:cut])
+        text = text[cut:]
+    if text:
+        parts.append(text)
+    return parts
+
+
+def split_chain(chain: Iterable, max_length=DEFAULT_MAX_LENGTH) -> List[list]:
+    """
+    split chain into parts holding at most max_length characters of plain text each.
+    cuts happen between elements or inside Plain texts at line, then word boundaries;
+    other elements are never cut and don't count towards the length
+    """
+    items = [item for item in chain if not isinstance(item, Source)]
+    if any(isinstance(item, UniqueModel) for item in items):
+        return [items]
+    parts: List[list] = [[]]
+    length = 0
+    for item in items:
+        if not isinstance(item, Plain):
+            parts[-1].append(item)
+            continue
+        text = item.text
+        while length + len(text) > max_length:
+            room = max_length - length
+            cut = _cut_point(text, room) if room > 0 else 0
+            if cut:
+                parts[-1].append(Plain(text[:cut]))
+                text = text[cut:]
+            parts.append([])
+            length = 0
+        if text:
+            parts[-1].append(Plain(text))
+            length += len(text)
+    return [part for part in parts if part]
+
+
+class _Batch:
+    __slots__ = ["texts", "length", "priority", "future", "timer"]
+
+    def __init__(self, priority: Optional[Priority], future: asyncio.Future):
+        self.texts: List[str] = []
+        self.length = 0
+        self.priority = priority
+        self.future = future
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class Coalescer(LoopBound):
+    """
+    merges Plain-only sends to the same target made within ``window`` seconds into one message,
+    texts are joined by ``separator``. batches to a target are sent in order, one at a time,
+    and every merged call gets the id of the message it ended up in
+    """
+
+    def __init__(
+            self,
+            send: Callable[[Key, list, Optional[Priority]], Awaitable[int]],
+            window=0.3,
+            max_length=DEFAULT_MAX_LENGTH,
+            separator="\n",
+            *, loop=None
+    ):
+        super().__init__(loop)
+        self.window = window
+        self.max_length = max_length
+        self.separator = separator
+        self._send = send
+        self._batches: Dict[Key, _Batch] = {}
+        self._tails: Dict[Key, asyncio.Task] = {}
+
+        self.merged = 0  # calls folded into another one's message
+        self.sent = 0
+
+    def pending(self, key: Key) -> bool:
+        return key in self._batches or key in self._tails
+
+    async def add(self, key: Key, text: str, priority: Priority = None) -> int:
+        """:return id of the message text was sent in"""
+        batch = self._batches.get(key)
+        if batch and batch.length + len(self.separator) + len(text) > self.max_length:
+            self._flush(key)
+            batch = None
+        if batch:
+            self.merged += 1
+            batch.length += len(self.separator)
+        else:
+            batch = self._batches[key] = _Batch(priority, self._loop.create_future())
+            # callers may all be gone when it fails
+            batch.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            batch.timer = self._loop.call_later(self.window, self._flush, key)
+        batch.texts.append(text)
+        batch.length += len(text)
+        # callers share the result, one of them being cancelled must not cancel the batch
+        return await asyncio.shield(batch.future)
+
+    async def flush(self, key: Key):
+        """send what is pending for key now and wait until it was sent"""
+        self._flush(key)
+        tail = self._tails.get(key)
+        if tail:
+            await asyncio.wait([tail])
+
+    async def flush_all(self):
+        for key in list(self._batches):
+            self._flush(key)
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+    def _flush(self, key: Key):
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        batch.timer.cancel()
+        task = self._loop.create_task(self._send_batch(key, batch, self._tails.get(key)))
+        self._tails[key] = task
+        task.add_done_callback(lambda t: self._tails.pop(key) if self._tails.get(key) is t else None)
+
+    async def _send_batch(self, key: Key, batch: _Batch, previous: Optional[asyncio.Task]):
+        if previous:
+            await asyncio.wait([previous])
+        try:
+            msg_id = await self._send(key, [Plain(self.separator.join(batch.texts))], batch.priority)
+        except Exception as e:
+            if not batch.future.done():
+                batch.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not batch.future.done():
+                batch.future.set_result(msg_id)
+        finally:
+            if not batch.future.done():
+                batch.future.cancel()
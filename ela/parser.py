@@ -0,0 +1,126 @@
+"""
+model construction for payloads coming from a trusted mirai-api-http,
+fields are assigned as received and only those needing coercion (enums, datetimes, urls...) are validated
+"""
+from enum import Enum
+from typing import Type, TypeVar, Dict, List, Tuple, Any, Optional
+
+from pydantic import BaseModel, ValidationError
+from pydantic.fields import ModelField, SHAPE_SINGLETON, SHAPE_LIST
+from pydantic.utils import lenient_issubclass
+
+from .message.chain import MessageChain
+from .message.models import message_model
+
+M = TypeVar("M", bound=BaseModel)
+
+_RAW, _ENUM, _MODEL, _LIST_MODEL, _CHAIN, _VALIDATE = range(6)
+_PLAIN_TYPES = (int, str, bool, float, dict, Any)
+_trusted = False
+_plans: Dict[type, Optional[List[Tuple[str, str, ModelField, int]]]] = {}
+
+
+def set_trusted(enabled: bool):
+    """change the default mode of :func:`parse`"""
+    global _trusted
+    _trusted = enabled
+
+
+def is_trusted() -> bool:
+    return _trusted
+
+
+def _field_kind(field: ModelField) -> int:
+    t = field.type_
+    if field.sub_fields and field.shape == SHAPE_SINGLETON or field.parse_json or field.pre_validators:
+        return _VALIDATE
+    if field.shape == SHAPE_LIST:
+        if lenient_issubclass(t, BaseModel) and _plan(t) is not None:
+            return _LIST_MODEL
+        return _VALIDATE
+    if field.shape != SHAPE_SINGLETON or field.post_validators or field.class_validators:
+        return _VALIDATE
+    if t in _PLAIN_TYPES:
+        return _RAW
+    if lenient_issubclass(t, Enum):
+        return _ENUM
+    if t is MessageChain:
+        return _CHAIN
+    if lenient_issubclass(t, BaseModel) and _plan(t) is not None:
+        return _MODEL
+    return _VALIDATE
+
+
+def _plan(model: Type[BaseModel]) -> Optional[List[Tuple[str, str, ModelField, int]]]:
+    """:return (name, alias, field, kind) of each field, None if the model must be validated as a whole"""
+    try:
+        return _plans[model]
+    except KeyError:
+        pass
+    _plans[model] = None  # guard against recursive models
+    if model.__validators__ or model.__pre_root_validators__ or model.__post_root_validators__:
+        return None
+    plan = [(name, field.alias, field, _field_kind(field)) for name, field in model.__fields__.items()]
+    _plans[model] = plan
+    return plan
+
+
+def _build_chain(items: list) -> MessageChain:
+    return _construct(MessageChain, {"__root__": [
+        item if not isinstance(item, dict) else _build(message_model[item["type"]], item)
+        for item in items
+    ]})
+
+
+def _construct(model: Type[M], values: dict) -> M:
+    obj = model.__new__(model)
+    object.__setattr__(obj, "__dict__", values)
+    object.__setattr__(obj, "__fields_set__", set(values))
+    if model.__private_attributes__:
+        obj._init_private_attributes()
+    return obj
+
+
+def _build(model: Type[M], data: dict) -> M:
+    plan = _plan(model)
+    if plan is None:
+        return model.parse_obj(data)
+    values = {}
+    for name, alias, field, kind in plan:
+        try:
+            value = data[alias]
+        except KeyError:
+            if field.required:
+                return model.parse_obj(data)  # let pydantic report the missing field
+            values[name] = field.get_default()
+            continue
+        if value is None or kind == _RAW:
+            values[name] = value
+        elif kind == _ENUM:
+            values[name] = field.type_(value)
+        elif kind == _MODEL:
+            values[name] = _build(field.type_, value) if isinstance(value, dict) else value
+        elif kind == _LIST_MODEL:
+            values[name] = [_build(field.type_, v) if isinstance(v, dict) else v for v in value]
+        elif kind == _CHAIN:
+            values[name] = _build_chain(value) if isinstance(value, list) else value
+        else:
+            value, error = field.validate(value, values, loc=alias, cls=model)
+            if error:
+                raise ValidationError([error], model)
+            values[name] = value
+    return _construct(model, values)
+
+
+def parse(model: Type[M], data: Any, trusted: bool = None) -> M:
+    """
+    build ``model`` from a payload, in trusted mode validation is skipped where it can be
+    :param trusted: None to use the global mode set by :func:`set_trusted`
+    """
+    if model.__custom_root_type__:
+        data = {"__root__": data}
+    if trusted is None:
+        trusted = _trusted
+    if not trusted:
+        return model.parse_obj(data)
+    return _build(model, data)
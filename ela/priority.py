@@ -0,0 +1,123 @@
+import asyncio
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Dict, Deque, Tuple, Optional
+
+from .runtime import LoopBound
+
+
+class Priority(IntEnum):
+    MODERATION = 0
+    INTERACTIVE = 1
+    NORMAL = 2
+    BULK = 3
+
+
+# default class of a command, anything else is NORMAL
+COMMAND_PRIORITY = {
+    "mute": Priority.MODERATION,
+    "unmute": Priority.MODERATION,
+    "muteAll": Priority.MODERATION,
+    "unmuteAll": Priority.MODERATION,
+    "kick": Priority.MODERATION,
+    "recall": Priority.MODERATION,
+    "memberAdmin": Priority.MODERATION,
+    "resp_newFriendRequestEvent": Priority.INTERACTIVE,
+    "resp_memberJoinRequestEvent": Priority.INTERACTIVE,
+    "resp_botInvitedJoinGroupRequestEvent": Priority.INTERACTIVE
+}
+
+
+class QueueStats:
+    __slots__ = ["count", "total_wait", "max_wait"]
+
+    def __init__(self):
+        self.count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        try:
+            return self.total_wait / self.count
+        except ZeroDivisionError:
+            return 0.0
+
+    def add(self, waited: float):
+        self.count += 1
+        self.total_wait += waited
+        if waited > self.max_wait:
+            self.max_wait = waited
+
+    def __repr__(self):
+        return f"<QueueStats count={self.count} average_wait={self.average_wait:.4f} max_wait={self.max_wait:.4f}>"
+
+
+class PriorityGate(LoopBound):
+    """
+    allows at most ``window`` requests awaiting the server, queued requests are admitted by
+    priority class; a request queued longer than ``max_wait`` seconds is admitted first
+    regardless of its class, so bulk traffic can't starve
+    """
+
+    def __init__(self, window=32, max_wait=2.0, *, loop=None):
+        super().__init__(loop)
+        self.window = window
+        self.max_wait = max_wait
+        self._in_flight = 0
+        self._waiting = 0
+        self._queues: Dict[Priority, Deque[Tuple[float, asyncio.Future]]] = {p: deque() for p in Priority}
+        self._stats: Dict[Priority, QueueStats] = {p: QueueStats() for p in Priority}
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def stats(self) -> Dict[Priority, QueueStats]:
+        return self._stats
+
+    def queued(self, priority: Optional[Priority] = None) -> int:
+        if priority is None:
+            return sum(len(q) for q in self._queues.values())
+        return len(self._queues[priority])
+
+    async def acquire(self, priority: Priority = Priority.NORMAL):
+        if self._in_flight < self.window and not self._waiting:
+            self._in_flight += 1
+            self._stats[priority].add(0.0)
+            return
+        fut = self._loop.create_future()
+        self._queues[priority].append((time.monotonic(), fut))
+        self._waiting += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():  # admitted just before the cancellation
+                self.release()
+            raise
+
+    def release(self):
+        self._in_flight -= 1
+        while self._waiting and self._in_flight < self.window:
+            priority = self._next_priority()
+            enqueued, fut = self._queues[priority].popleft()
+            self._waiting -= 1
+            if fut.done():  # cancelled while queued
+                continue
+            self._in_flight += 1
+            self._stats[priority].add(time.monotonic() - enqueued)
+            fut.set_result(None)
+
+    def _next_priority(self) -> Priority:
+        deadline = time.monotonic() - self.max_wait
+        starved, first = None, None
+        for priority, queue in self._queues.items():
+            if not queue:
+                continue
+            if first is None:
+                first = priority
+            if queue[0][0] <= deadline and (starved is None or queue[0][0] < self._queues[starved][0][0]):
+                starved = priority
+        return first if starved is None else starved
@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from .filters import group_id, sender_id
+
+# where a message was sent, the key of :mod:`ela.outbound`: ("group", id) / ("friend", id) / ("temp", group, qq)
+Target = Tuple
+
+
+def inbound_target(data_type: str, data: dict) -> Optional[Target]:
+    """:return the target a reply to a raw inbound message is sent to, None if the bot can't message it"""
+    if data_type == "GroupMessage":
+        return "group", group_id(data)
+    elif data_type == "FriendMessage":
+        return "friend", sender_id(data)
+    elif data_type == "TempMessage":
+        return "temp", group_id(data), sender_id(data)
+    return None
+
+
+class ReplyRouter:
+    """
+    callbacks waiting for replies to messages sent by the bot, indexed by target and message id
+    (message ids are only unique within a conversation): an inbound message quoting one of them
+    is found with a dict lookup whatever the number of open prompts.
+    entries expire after their ttl, and the oldest ones are dropped beyond ``capacity``
+    """
+
+    def __init__(self, ttl=600.0, capacity=4096, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._clock = clock
+        # (target, message id) -> (deadline, callback, once), oldest registration first
+        self._routes: "OrderedDict[Tuple[Target, int], Tuple[float, Callable, bool]]" = OrderedDict()
+
+        self.routed = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __contains__(self, key: Tuple[Target, int]):
+        """:param key: (target, message id)"""
+        return key in self._routes
+
+    def add(self, target: Target, message_id: int, callback: Callable, ttl: float = None, once=False):
+        """
+        :param target: where the message was sent
+        :param ttl: seconds replies are routed to callback, defaults to ``self.ttl``
+        :param once: forget the message after its first reply
+        """
+        if message_id is None or message_id == -1:  # not sent
+            return
+        key = (target, message_id)
+        now = self._clock()
+        self._expire(now)
+        self._routes[key] = (now + (self.ttl if ttl is None else ttl), callback, once)
+        self._routes.move_to_end(key)
+        while len(self._routes) > self.capacity:
+            self._routes.popitem(last=False)
+            self.expired += 1
+
+    def discard(self, target: Target, message_id: int):
+        self._routes.pop((target, message_id), None)
+
+    def _expire(self, now: float):
+        # deadlines are nearly ordered, entries with a longer ttl left behind are caught at lookup
+        routes = self._routes
+        while routes:
+            key, (deadline, _, _) = next(iter(routes.items()))
+            if deadline > now:
+                break
+            del routes[key]
+            self.expired += 1
+
+    def get(self, target: Target, message_id: int) -> Optional[Callable]:
+        """:return the callback waiting for replies to message_id sent to target"""
+        key = (target, message_id)
+        entry = self._routes.get(key)
+        if entry is None:
+            return None
+        deadline, callback, once = entry
+        if deadline <= self._clock():
+            del self._routes[key]
+            self.expired += 1
+            return None
+        if once:
+            del self._routes[key]
+        self.routed += 1
+        return callback
+
+    def route(self, target: Optional[Target], chain: List[dict]) -> Optional[Callable]:
+        """
+        :param target: see :func:`inbound_target`
+        :return the callback of the message a raw message chain received from target quotes, if any
+        """
+        if not self._routes or target is None:
+            return None
+        for item in chain:
+            if item.get("type") == "Quote":
+                return self.get(target, item["id"])
+        return None
@@ -0,0 +1,119 @@
+"""
+event loop management shared by every component.
+components don't capture a loop when they are created, they resolve it on use through :func:`get_loop`,
+so an application built before ``asyncio.run`` (or before :func:`install_policy`) runs on the loop driving it.
+asyncio primitives are created on first use for the same reason, before 3.10 they attach to a loop when created
+"""
+import asyncio
+import logging
+import signal
+import warnings
+from typing import Optional, Callable, Awaitable, Coroutine, Any
+
+logger = logging.getLogger(__name__)
+
+_policy: Optional[str] = None
+
+
+def install_policy(use_uvloop: bool = None) -> str:
+    """
+    select the event loop policy, call it before any loop is created
+    :param use_uvloop: True to require uvloop, False for the stdlib loop, None to use uvloop when installed
+    :return the name of the installed policy
+    """
+    global _policy
+    name = "asyncio"
+    if use_uvloop or use_uvloop is None:
+        try:
+            import uvloop
+        except ImportError:
+            if use_uvloop:
+                raise
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            name = "uvloop"
+    if name == "asyncio" and _policy == "uvloop":
+        asyncio.set_event_loop_policy(None)
+    _policy = name
+    logger.debug("event loop policy: %s", name)
+    return name
+
+
+def policy() -> Optional[str]:
+    """:return the policy installed by :func:`install_policy`, None if it was never called"""
+    return _policy
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    :return the running loop, otherwise the current loop of the policy, which :func:`run` will drive
+    (created on demand)
+    """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    try:
+        with warnings.catch_warnings():
+            # 3.12+ warns when the policy has to create the loop
+            warnings.simplefilter("ignore", DeprecationWarning)
+            loop = asyncio.get_event_loop()
+    except RuntimeError:
+        # 3.14+, or outside of the main thread: no current loop
+        loop = None
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop
+
+
+def _watch_sigterm(loop: asyncio.AbstractEventLoop, shutdown: Callable[[], Awaitable]) -> Optional[list]:
+    """:return a list receiving the shutdown task once SIGTERM arrives, None if signals can't be watched"""
+    started = []
+
+    def handler():
+        logger.warning("SIGTERM received, stopping...")
+        loop.remove_signal_handler(signal.SIGTERM)
+        started.append(loop.create_task(shutdown()))
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, handler)
+    except (NotImplementedError, RuntimeError, ValueError):
+        # not supported on windows, nor outside of the main thread
+        return None
+    return started
+
+
+def run(main: Coroutine, *, shutdown: Callable[[], Awaitable] = None, name: str = None) -> Any:
+    """
+    drive ``main`` until it completes, on KeyboardInterrupt ``shutdown`` is awaited instead.
+    on SIGTERM ``shutdown`` is scheduled alongside ``main``, it should make ``main`` return.
+    the loop is left open, so it may be reused by the next call
+    """
+    loop = get_loop()
+    if loop.is_running():
+        raise RuntimeError("run() cannot be called from a running event loop, await the coroutine instead")
+    started = _watch_sigterm(loop, shutdown) if shutdown else None
+    try:
+        return loop.run_until_complete(loop.create_task(main, name=name))
+    except KeyboardInterrupt:
+        logger.warning("Interrupt received, stopping...")
+        if shutdown:
+            loop.run_until_complete(shutdown())
+    finally:
+        if started is not None:
+            loop.remove_signal_handler(signal.SIGTERM)
+            if started and not started[0].done():
+                # main returned once the connection closed, let shutdown finish its report
+                loop.run_until_complete(started[0])
+
+
+class LoopBound:
+    """resolves ``_loop`` on use, unless a loop was given explicitly"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self._bound_loop = loop
+
+    @property
+    def _loop(self) -> asyncio.AbstractEventLoop:
+        return self._bound_loop or get_loop()
@@ -1,17 +1,143 @@
 import asyncio
+import datetime
 import functools
+import heapq
+import itertools
+import logging
 from time import time
-from typing import Awaitable
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
+from .runtime import LoopBound
+from .utils import run_function
 
-class Timer:
-    def __init__(self, *, loop=None):
-        if not loop:
-            loop = asyncio.get_event_loop()
-        self._loop = loop
+logger = logging.getLogger(__name__)
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> Set[int]:
+    values = set()
+    for part in field.split(","):
+        body, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if body == "*":
+            start, end = low, high
+        elif "-" in body:
+            start, end = map(int, body.split("-", 1))
+        else:
+            start = end = int(body)
+            if step != 1:
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"cron field '{field}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """standard 5 field cron expression: minute hour day-of-month month day-of-week"""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"expect 5 cron fields, but {len(fields)} got")
+        self.expr = expr
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_cron_field(fields[4], 0, 7)}  # 0 and 7 are sunday
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime.datetime) -> bool:
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        if self._any_day:
+            return weekday
+        elif self._any_weekday:
+            return dt.day in self.days
+        return dt.day in self.days or weekday
+
+    def next_after(self, dt: datetime.datetime) -> datetime.datetime:
+        dt = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = dt.year + 5
+        while dt.year <= limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"cron '{self.expr}' never matches")
+
+    def __repr__(self):
+        return f"<CronSpec '{self.expr}'>"
+
+
+class Job:
+    __slots__ = [
+        "id", "name", "func", "args", "kwargs", "interval", "cron", "due", "scheduled_at", "cancelled",
+        "running", "runs", "failures", "skipped", "missed", "total_time", "max_time", "last_run"
+    ]
+
+    def __init__(self, job_id: int, name: str, func, args, kwargs,
+                 interval: Optional[float] = None, cron: Optional[CronSpec] = None):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.interval = interval
+        self.cron = cron
+        self.due = 0.0  # loop time of the next run
+        self.scheduled_at: Optional[datetime.datetime] = None  # wall clock time of the next cron run
+        self.cancelled = False
+        self.running = 0
+
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # still running when due again
+        self.missed = 0  # runs coalesced after the loop fell behind
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_run: Optional[float] = None
+
+    @property
+    def average_time(self) -> float:
+        try:
+            return self.total_time / self.runs
+        except ZeroDivisionError:
+            return 0.0
+
+    @property
+    def repeating(self) -> bool:
+        return bool(self.interval or self.cron)
+
+    def __repr__(self):
+        return (
+            f"<Job id={self.id} name='{self.name}' runs={self.runs} failures={self.failures} "
+            f"average_time={self.average_time:.4f} max_time={self.max_time:.4f}>"
+        )
+
+
+class Timer(LoopBound):
+    def __init__(self, *, loop=None, max_concurrent_jobs: int = None):
+        super().__init__(loop)
 
         self._transaction_count = 0
         self._used_time = 0.0
+        self._tasks: Set[asyncio.Task] = set()  # running handlers and jobs
+        self._stopped = False
+
+        # jobs are kept in one heap, a single loop timer is armed for the nearest one
+        self._jobs: Dict[int, Job] = {}
+        self._heap: List[Tuple[float, int, Job]] = []
+        self._job_ids = itertools.count(1)
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._max_concurrent_jobs = max_concurrent_jobs
+        self._job_slots: Optional[asyncio.Semaphore] = None  # created by the first job
 
     @property
     def transaction_count(self) -> int:
@@ -28,13 +154,179 @@ class Timer:
         except ZeroDivisionError:
             return 0.0
 
+    @property
+    def jobs(self) -> Dict[int, Job]:
+        return self._jobs
+
+    @property
+    def running(self) -> int:
+        """:return count of handlers and jobs still running"""
+        return len(self._tasks)
+
     def _calc_used_time(self, real_time: float, _task):
         # loop_time_calc, real_time_calc = self._loop.time() - loop_time, time() - real_time
         self._used_time += time() - real_time
         self._transaction_count += 1
 
-    def executor(self, coro: Awaitable):
+    def _track(self, coro: Awaitable) -> asyncio.Task:
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def executor(self, coro: Awaitable) -> asyncio.Task:
         real_time = time()
-        self._loop.create_task(coro).add_done_callback(
+        task = self._track(coro)
+        task.add_done_callback(
             functools.partial(self._calc_used_time, real_time)
         )
+        return task
+
+    def stop(self):
+        """stop running scheduled jobs, they stay registered until :meth:`resume`"""
+        self._stopped = True
+        if self._wakeup:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+    def resume(self):
+        if self._stopped:
+            self._stopped = False
+            self._arm()
+
+    async def drain(self, timeout: float) -> Tuple[int, int]:
+        """
+        wait for running handlers and jobs, those still running after timeout seconds are cancelled.
+        the task calling it is left out
+        :return (finished, cancelled)
+        """
+        deadline = self._loop.time() + timeout
+        finished = 0
+        # a handler shutting the application down doesn't wait for (or cancel) itself
+        current = {asyncio.current_task()}
+        waiting = self._tasks - current
+        while waiting:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            done, waiting = await asyncio.wait(waiting, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finished += len(done)
+            # handlers may start new tasks while draining, they are waited for as well
+            waiting |= self._tasks - current
+        pending = self._tasks - current
+        for task in pending:
+            task.cancel()
+        if pending:
+            # give cancelled tasks a chance to run their cleanup, but don't hang on one ignoring it
+            await asyncio.wait(pending, timeout=1.0)
+        return finished, len(pending)
+
+    def _add_job(self, func, args, kwargs, delay: float, name=None, **options) -> Job:
+        job = Job(next(self._job_ids), name or getattr(func, "__name__", repr(func)), func, args, kwargs, **options)
+        self._jobs[job.id] = job
+        self._push(job, self._loop.time() + delay)
+        self._arm()
+        return job
+
+    def call_later(self, delay: float, func: Callable, *args, name=None, **kwargs) -> Job:
+        return self._add_job(func, args, kwargs, delay, name)
+
+    def every(self, interval: float, func: Callable, *args, first: float = None, name=None, **kwargs) -> Job:
+        """:param first: delay of the first run, defaults to interval"""
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        return self._add_job(func, args, kwargs, interval if first is None else first, name, interval=interval)
+
+    def cron(self, expr: Union[str, CronSpec], func: Callable, *args, name=None, **kwargs) -> Job:
+        spec = expr if isinstance(expr, CronSpec) else CronSpec(expr)
+        now = datetime.datetime.now()
+        scheduled_at = spec.next_after(now)
+        job = self._add_job(func, args, kwargs, (scheduled_at - now).total_seconds(), name, cron=spec)
+        job.scheduled_at = scheduled_at
+        return job
+
+    def cancel(self, job: Union[Job, int]) -> bool:
+        job = self._jobs.pop(job.id if isinstance(job, Job) else job, None)
+        if not job:
+            return False
+        job.cancelled = True
+        return True
+
+    @staticmethod
+    def _cron_delay(job: Job) -> float:
+        # loop time and wall clock drift apart, a wall clock still behind the run that just fired
+        # must not schedule it again
+        now = datetime.datetime.now()
+        job.scheduled_at = job.cron.next_after(max(job.scheduled_at, now) if job.scheduled_at else now)
+        return (job.scheduled_at - now).total_seconds()
+
+    def _push(self, job: Job, due: float):
+        job.due = due
+        heapq.heappush(self._heap, (due, job.id, job))
+
+    def _arm(self):
+        if self._stopped:
+            return
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return
+        due = self._heap[0][0]
+        if self._wakeup:
+            if self._wakeup.when() <= due:
+                return
+            self._wakeup.cancel()
+        self._wakeup = self._loop.call_at(due, self._run_due)
+
+    def _run_due(self):
+        self._wakeup = None
+        now = self._loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            due, _, job = heapq.heappop(self._heap)
+            if job.cancelled or due != job.due:
+                continue
+            if job.running and job.repeating:
+                job.skipped += 1
+            else:
+                self._track(self._run_job(job))
+            if job.interval:
+                due += job.interval
+                if due <= now:
+                    # the loop fell behind, run once and realign instead of catching up
+                    behind = int((now - due) // job.interval) + 1
+                    job.missed += behind
+                    due += behind * job.interval
+                self._push(job, due)
+            elif job.cron:
+                self._push(job, now + self._cron_delay(job))
+            else:
+                self._jobs.pop(job.id, None)
+        self._arm()
+
+    async def _run_job(self, job: Job):
+        job.running += 1
+        try:
+            if self._max_concurrent_jobs:
+                if self._job_slots is None:
+                    self._job_slots = asyncio.Semaphore(self._max_concurrent_jobs)
+                async with self._job_slots:
+                    await self._call_job(job)
+            else:
+                await self._call_job(job)
+        finally:
+            job.running -= 1
+
+    async def _call_job(self, job: Job):
+        start = self._loop.time()
+        job.last_run = time()
+        try:
+            await run_function(job.func, *job.args, **job.kwargs)
+        except Exception:
+            job.failures += 1
+            logger.exception(f"job {job.name}({job.id}) raise an error")
+        finally:
+            used = self._loop.time() - start
+            job.runs += 1
+            job.total_time += used
+            if used > job.max_time:
+                job.max_time = used
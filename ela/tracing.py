@@ -0,0 +1,255 @@
+"""
+optional tracing of the inbound and outbound pipelines.
+
+a sampled inbound frame starts a trace, every stage it goes through (decoding, model building, dispatch,
+the handler, and the requests the handler sends) records a span under it. spans of one trace are exported
+together once all of them ended, to a callable or to a file in the OpenTelemetry (OTLP/JSON) format.
+when tracing is disabled, or a frame isn't sampled, instrumented code only pays a global lookup
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# OpenTelemetry span kinds
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT, KIND_PRODUCER, KIND_CONSUMER = 1, 2, 3, 4, 5
+
+Exporter = Callable[[List["Span"]], None]
+
+_tracer: Optional["Tracer"] = None
+_current: ContextVar[Optional["Span"]] = ContextVar("ela_span", default=None)
+
+
+class _Trace:
+    __slots__ = ["tracer", "trace_id", "spans", "open", "dropped"]
+
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self.open = 0
+        self.dropped = False
+
+    def start(self, name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]) -> "Span":
+        self.open += 1
+        return Span(self, name, parent_id, kind, attributes)
+
+
+class Span:
+    __slots__ = ["trace", "span_id", "parent_id", "name", "kind", "start_time", "end_time", "attributes", "error"]
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    @property
+    def duration(self) -> float:
+        """seconds, 0 while running"""
+        return (self.end_time - self.start_time) / 1e9 if self.end_time else 0.0
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def discard(self):
+        """drop the whole trace, nothing of it is exported"""
+        self.trace.dropped = True
+
+    def end(self, error: BaseException = None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        if error is not None:
+            self.error = repr(error)
+        trace = self.trace
+        trace.spans.append(self)
+        trace.open -= 1
+        if not trace.open and not trace.dropped:
+            trace.tracer.export(trace.spans)
+
+    def _end_task(self, task: asyncio.Task):
+        self.end(None if task.cancelled() else task.exception())
+
+    def __repr__(self):
+        return f"<Span {self.name} duration={self.duration:.6f} attributes={self.attributes}>"
+
+
+class _Null:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *_):
+        return False
+
+
+_NULL = _Null()
+
+
+class _Scope:
+    __slots__ = ["span", "token"]
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, typ, value, tb):
+        _current.reset(self.token)
+        self.span.end(value)
+        return False
+
+
+class Tracer:
+    def __init__(self, exporter: Exporter, sample_rate=1.0):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be in [0, 1]")
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.traces = 0
+        self.exported = 0
+
+    def export(self, spans: List[Span]):
+        self.exported += 1
+        try:
+            self.exporter(spans)
+        except Exception:
+            logger.exception("span exporter raise an error")
+
+
+def enable(exporter: Exporter, sample_rate=1.0) -> Tracer:
+    """
+    :param exporter: called with the spans of each finished trace, e.g. a :class:`FileExporter`
+    :param sample_rate: fraction of inbound frames traced
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(exporter, sample_rate)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer and hasattr(tracer.exporter, "close"):
+        tracer.exporter.close()
+
+
+def tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+def trace(name: str, kind=KIND_CONSUMER, **attributes):
+    """
+    start a sampled trace, as a context manager yielding its root span (None when not traced)
+    """
+    t = _tracer
+    if t is None or (t.sample_rate < 1 and random.random() >= t.sample_rate):
+        return _NULL
+    t.traces += 1
+    return _Scope(_Trace(t).start(name, None, kind, attributes))
+
+
+def stage(name: str, kind=KIND_INTERNAL, **attributes):
+    """a child span of the current one as a context manager, a no-op outside a trace"""
+    if _tracer is None:
+        return _NULL
+    parent = _current.get()
+    if parent is None:
+        return _NULL
+    return _Scope(parent.trace.start(name, parent.span_id, kind, attributes))
+
+
+def spawn(name: str, create: Callable[[], asyncio.Task], **attributes) -> asyncio.Task:
+    """call create() inside a new child span, the task inherits the span which ends with the task"""
+    if _tracer is None:
+        return create()
+    parent = _current.get()
+    if parent is None:
+        return create()
+    span = parent.trace.start(name, parent.span_id, KIND_INTERNAL, attributes)
+    token = _current.set(span)
+    try:
+        task = create()
+    except BaseException as e:
+        span.end(e)
+        raise
+    finally:
+        _current.reset(token)
+    task.add_done_callback(span._end_task)
+    return task
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)}
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span], service_name="ela") -> dict:
+    """:return spans as an OTLP/JSON ExportTraceServiceRequest"""
+    out = []
+    for span in spans:
+        item = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_time),
+            "endTimeUnixNano": str(span.end_time),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            item["parentSpanId"] = span.parent_id
+        out.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "ela"}, "spans": out}]
+    }]}
+
+
+class FileExporter:
+    """appends one OTLP/JSON line per trace to path, as the OpenTelemetry file exporter does"""
+
+    def __init__(self, path: str, service_name="ela"):
+        self.path = path
+        self.service_name = service_name
+        self._fd = open(path, "a", encoding="utf-8")
+
+    def __call__(self, spans: List[Span]):
+        self._fd.write(json.dumps(to_otlp(spans, self.service_name), separators=(",", ":")))
+        self._fd.write("\n")
+
+    def flush(self):
+        self._fd.flush()
+
+    def close(self):
+        if not self._fd.closed:
+            self._fd.close()
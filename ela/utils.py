@@ -2,12 +2,10 @@ import asyncio
 import logging
 from typing import List, Union, Callable, Coroutine
 
-import aiohttp
-
 from .message.base import MessageModel, RemoteResource, Unprepared
+from .runtime import get_loop, run
 
 logger = logging.getLogger(__name__)
-_LOOP = asyncio.get_event_loop()
 
 
 async def run_function(func, *args, **kwargs):
@@ -42,12 +40,13 @@ async def prepare_chain(network, utype: str, chain) -> List[Union[MessageModel,
 
 def call_later(delay: int, func, *args, **kwargs) -> asyncio.TimerHandle:
     logger.debug(f"function {func} will execute in {delay}s")
-    return _LOOP.call_later(delay, _LOOP.create_task, run_function(func, *args, **kwargs))
+    loop = get_loop()
+    return loop.call_later(delay, loop.create_task, run_function(func, *args, **kwargs))
 
 
 async def async_retry(coro: Callable[[], Coroutine], count: int, *, loop=None) -> bool:
     if not loop:
-        loop = asyncio.get_event_loop()
+        loop = get_loop()
     while count >= 0:
         task = loop.create_task(coro())
         if await task:
@@ -59,9 +58,11 @@ async def async_retry(coro: Callable[[], Coroutine], count: int, *, loop=None) -
     return False
 
 
-async def _run_app(app, close):
+async def _run_app(app, close: list):
+    import aiohttp
+
     logger.info("Daemon running")
-    while not close.is_set():
+    while not close:
         logger.debug("Checking availability...")
         try:
             async with aiohttp.request("GET", app.network.url) as resp:
@@ -73,18 +74,17 @@ async def _run_app(app, close):
             continue
         logger.debug("Service available")
         await app.async_run()
-        if not close.is_set():
+        if not close:
             logger.warning("Application exit, restarting")
             await app.network.reset()
 
 
-def run_app(app):
-    close = asyncio.Event()
-    daemon = _LOOP.create_task(_run_app(app, close), name="daemon")
-    try:
-        _LOOP.run_until_complete(daemon)
-    except KeyboardInterrupt:
-        logger.warning("Interrupt received, stopping...")
-        close.set()
-        _LOOP.run_until_complete(app.close())
+def run_app(app, *, drain_timeout: float = 10.0):
+    close = []  # not an asyncio.Event, created before the loop it would bind to on 3.8/3.9
+
+    async def shutdown():
+        close.append(True)
+        await app.shutdown(drain_timeout)
+
+    run(_run_app(app, close), shutdown=shutdown, name="daemon")
     logger.info("Daemon stopped")
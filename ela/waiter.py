@@ -0,0 +1,114 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Dict, Tuple, Optional, List, Callable, Any
+
+from .runtime import LoopBound
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, Optional[int], Optional[int]]
+
+
+class _Waiter:
+    __slots__ = ["key", "future", "predicate"]
+
+    def __init__(self, key: Key, future: asyncio.Future, predicate: Optional[Callable[[Any], bool]]):
+        self.key = key
+        self.future = future
+        self.predicate = predicate
+
+
+class WaiterIndex(LoopBound):
+    """
+    pending wait_for calls indexed by (event type, group, sender),
+    all timeouts share a single loop timer armed for the nearest deadline
+    """
+
+    def __init__(self, *, loop=None):
+        super().__init__(loop)
+        self._index: Dict[Key, List[_Waiter]] = {}
+        self._types: Dict[str, int] = {}
+        self._deadlines: List[Tuple[float, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def __contains__(self, typ: str) -> bool:
+        return typ in self._types
+
+    def __len__(self):
+        return sum(self._types.values())
+
+    def add(self, typ: str, group: int = None, sender: int = None,
+            predicate: Callable[[Any], bool] = None, timeout: float = None) -> asyncio.Future:
+        key = (typ, group, sender)
+        waiter = _Waiter(key, self._loop.create_future(), predicate)
+        self._index.setdefault(key, []).append(waiter)
+        self._types[typ] = self._types.get(typ, 0) + 1
+        waiter.future.add_done_callback(lambda _: self._discard(waiter))
+        if timeout is not None:
+            heapq.heappush(self._deadlines, (self._loop.time() + timeout, next(self._seq), waiter))
+            self._arm()
+        return waiter.future
+
+    def candidates(self, typ: str, group: Optional[int], sender: Optional[int]) -> List[_Waiter]:
+        index = self._index
+        found = []
+        for key in ((typ, group, sender), (typ, group, None), (typ, None, sender), (typ, None, None)):
+            waiters = index.get(key)
+            if waiters:
+                found.extend(waiters)
+        return found
+
+    def resolve(self, candidates: List[_Waiter], obj) -> bool:
+        """hand obj to the first candidate accepting it"""
+        for waiter in candidates:
+            if waiter.future.done():
+                continue
+            if waiter.predicate:
+                try:
+                    if not waiter.predicate(obj):
+                        continue
+                except Exception:
+                    logger.exception("wait_for predicate raise an error")
+                    continue
+            waiter.future.set_result(obj)
+            return True
+        return False
+
+    def _discard(self, waiter: _Waiter):
+        waiters = self._index.get(waiter.key)
+        if not waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self._index[waiter.key]
+        typ = waiter.key[0]
+        self._types[typ] -= 1
+        if not self._types[typ]:
+            del self._types[typ]
+
+    def _arm(self):
+        while self._deadlines and self._deadlines[0][2].future.done():
+            heapq.heappop(self._deadlines)
+        if not self._deadlines:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            return
+        when = self._deadlines[0][0]
+        if self._timer and self._timer.when() <= when:
+            return
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self._loop.call_at(when, self._expire)
+
+    def _expire(self):
+        self._timer = None
+        now = self._loop.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, waiter = heapq.heappop(self._deadlines)
+            if not waiter.future.done():
+                waiter.future.set_exception(asyncio.TimeoutError())
+        self._arm()
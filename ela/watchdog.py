@@ -0,0 +1,199 @@
+import functools
+import heapq
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from types import CodeType
+from typing import Deque, Dict, List, Optional, Callable
+
+from .runtime import LoopBound
+
+logger = logging.getLogger(__name__)
+
+
+class Invocation:
+    __slots__ = ["event_type", "handler", "started", "duration", "timed_out"]
+
+    def __init__(self, event_type: str, handler: str):
+        self.event_type = event_type
+        self.handler = handler
+        self.started = time.time()
+        self.duration = 0.0
+        self.timed_out = False
+
+    def __repr__(self):
+        return (
+            f"<Invocation {self.handler} event_type={self.event_type} "
+            f"duration={self.duration:.4f} timed_out={self.timed_out}>"
+        )
+
+
+class Stall:
+    __slots__ = ["started", "duration", "handler", "location"]
+
+    def __init__(self, handler: Optional[str], location: Optional[str]):
+        self.started = time.time()
+        self.duration = 0.0
+        self.handler = handler  # None when no registered handler was on the stack
+        self.location = location
+
+    def __repr__(self):
+        return f"<Stall duration={self.duration:.3f} handler={self.handler} location={self.location}>"
+
+
+def _name_of(func: Callable) -> str:
+    return getattr(func, "__qualname__", None) or repr(func)
+
+
+def _code_of(func: Callable) -> Optional[CodeType]:
+    func = getattr(func, "__func__", func)
+    return getattr(func, "__code__", None)
+
+
+class Watchdog(LoopBound):
+    """
+    measures event loop lag with a tick every ``interval`` seconds. a monitor thread checks the tick,
+    and when the loop is blocked longer than ``threshold`` it inspects the loop thread's stack
+    to find the handler responsible, so a blocking call is reported while it still blocks.
+    handler invocations are tracked in a ring buffer, optionally cancelled after a timeout
+    """
+
+    def __init__(self, interval=0.1, threshold=0.5, history=1024, *, loop=None):
+        super().__init__(loop)
+        self.interval = interval
+        self.threshold = threshold
+        self._invocations: Deque[Invocation] = deque(maxlen=history)
+        self._stalls: Deque[Stall] = deque(maxlen=64)
+        self._codes: Dict[CodeType, str] = {}
+        self._timeouts = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+        self._expected = 0.0
+        self._heartbeat = 0.0
+        self._tick_handle = None
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._stall: Optional[Stall] = None  # written by the monitor thread
+
+    @property
+    def last_lag(self) -> float:
+        return self._last_lag
+
+    @property
+    def max_lag(self) -> float:
+        return self._max_lag
+
+    @property
+    def timeouts(self) -> int:
+        return self._timeouts
+
+    @property
+    def stalls(self) -> List[Stall]:
+        return list(self._stalls)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def slowest(self, n=10) -> List[Invocation]:
+        """:return the n slowest of the recent invocations"""
+        return heapq.nlargest(n, self._invocations, key=lambda i: i.duration)
+
+    def watch(self, func: Callable):
+        """make stalls inside func attributable to it"""
+        code = _code_of(func)
+        if code:
+            self._codes[code] = _name_of(func)
+
+    def track(self, task, event_type: str, handler: Callable, timeout: float = None):
+        """
+        record the invocation when task is done (only while the watchdog runs), cancel it after timeout seconds.
+        a timeout can only interrupt a handler awaiting something, a blocking one is reported as a stall
+        """
+        if self._thread is None and not timeout:
+            return  # nothing to do, keep dispatch free of the bookkeeping
+        invocation = Invocation(event_type, _name_of(handler))
+        expire = self._loop.call_later(timeout, self._expire, task, invocation) if timeout else None
+        task.add_done_callback(functools.partial(self._finish, invocation, self._loop.time(), expire))
+
+    def _expire(self, task, invocation: Invocation):
+        if task.done():
+            return
+        invocation.timed_out = True
+        self._timeouts += 1
+        logger.warning(f"handler {invocation.handler} for {invocation.event_type} timed out, cancelled")
+        task.cancel()
+
+    def _finish(self, invocation: Invocation, start: float, expire, _task):
+        if expire:
+            expire.cancel()
+        invocation.duration = self._loop.time() - start
+        self._invocations.append(invocation)
+
+    def start(self):
+        """start measuring, must be called from the loop thread"""
+        if self._thread:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._expected = self._loop.time() + self.interval
+        self._tick_handle = self._loop.call_at(self._expected, self._tick)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._monitor, name="ela-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._tick_handle.cancel()
+        self._thread.join()
+        self._thread = None
+
+    def _tick(self):
+        now = self._loop.time()
+        lag = now - self._expected
+        self._heartbeat = time.monotonic()
+        self._last_lag = lag
+        if lag > self._max_lag:
+            self._max_lag = lag
+        stall, self._stall = self._stall, None
+        if lag >= self.threshold:
+            if not stall:
+                # shorter than the monitor could catch
+                stall = Stall(None, None)
+            stall.duration = lag
+            self._stalls.append(stall)
+            if stall.handler:
+                logger.warning(f"event loop blocked for {lag:.3f}s by {stall.handler} at {stall.location}")
+            else:
+                logger.warning(f"event loop blocked for {lag:.3f}s")
+        self._expected = now + self.interval
+        self._tick_handle = self._loop.call_at(self._expected, self._tick)
+
+    def _monitor(self):
+        while not self._stopping.wait(self.interval):
+            if self._stall or time.monotonic() - self._heartbeat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._stall = self._attribute(frame)
+            logger.warning(
+                f"event loop blocked for over {self.threshold}s, "
+                f"in {self._stall.handler or 'unknown'} at {self._stall.location}"
+            )
+
+    def _attribute(self, frame) -> Stall:
+        code = frame.f_code
+        location = f"{code.co_filename}:{frame.f_lineno} ({code.co_name})"
+        while frame is not None:
+            handler = self._codes.get(frame.f_code)
+            if handler:
+                return Stall(handler, location)
+            frame = frame.f_back
+        return Stall(None, location)
@@ -8,5 +8,6 @@ setup(
     license='AGPL v3',
     author='wyapx',
     author_email='null@teahou.se',
-    description='一个高性能的mirai sdk（基于mirai-api-http）'
+    description='一个高性能的mirai sdk（基于mirai-api-http）',
+    extras_require={'uvloop': ['uvloop']}
 )